@@ -0,0 +1,152 @@
+import os
+import math
+import time
+import zlib
+import struct
+import threading
+from collections import OrderedDict
+
+from flask import g, request, jsonify
+
+from storage import FILE_LOCKING, file_lock
+
+
+def _refill(tokens, stamp, now, rate, burst):
+    """Tokens in a bucket last seen at stamp, topped up at rate per second."""
+    if stamp is None:
+        return burst
+    return min(burst, tokens + max(now - stamp, 0) * rate)
+
+
+class MemoryBuckets:
+    """Token buckets held by this process, keeping the most recently seen clients."""
+
+    def __init__(self, max_clients=100000):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Takes one token; returns 0 if there was one, else the seconds until there will be."""
+        with self._lock:
+            tokens, stamp = self._buckets.get(key, (None, None))
+            tokens = _refill(tokens, stamp, now, rate, burst)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class FileBuckets:
+    """Token buckets shared by every worker process through a file of fixed slots.
+
+    Each (route, client) hashes to one of ``slots`` 16-byte slots, which is
+    read and written under an fcntl record lock on just that slot, so workers
+    only contend when they serve the same client. Two clients that hash to the
+    same slot share a bucket; with the default 65536 slots that is rare.
+    """
+
+    SLOT = struct.Struct('<dd')
+
+    def __init__(self, path, slots=65536):
+        self.path = path
+        self.slots = slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < slots * self.SLOT.size:
+            os.ftruncate(self._fd, slots * self.SLOT.size)
+        # fcntl record locks do not exclude threads of the same process
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        offset = zlib.crc32(key.encode('utf-8')) % self.slots * self.SLOT.size
+        with self._lock, file_lock(self._fd, length=self.SLOT.size, offset=offset):
+            tokens, stamp = self.SLOT.unpack(os.pread(self._fd, self.SLOT.size, offset))
+            tokens = _refill(tokens, stamp or None, now, rate, burst)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            os.pwrite(self._fd, self.SLOT.pack(tokens, now), offset)
+        return wait
+
+
+class AdmissionControl:
+    """Turns away requests to expensive endpoints before they use up the workers.
+
+    ADMISSION_LIMITS maps an endpoint to its limits, applied to the listed
+    methods (POST by default, so the login and upload pages themselves are
+    never limited):
+
+    * ``concurrency``: requests handled at once by this worker process.
+      Beyond it the request gets a 503 straight away, so the remaining
+      threads stay free for cheap pages such as the listing.
+    * ``rate`` and ``burst``: a token bucket per client address, refilled at
+      ``rate`` requests per second up to ``burst``. An empty bucket gets a
+      429.
+
+    Both answers carry Retry-After. The buckets live in this process unless
+    ADMISSION_STATE_FILE names a file to share them between workers.
+    Concurrency is always counted per process.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.limits = app.config['ADMISSION_LIMITS']
+        state_file = app.config.get('ADMISSION_STATE_FILE')
+        if state_file and FILE_LOCKING:
+            self.buckets = FileBuckets(state_file)
+        else:
+            self.buckets = MemoryBuckets()
+        self._slots = {endpoint: threading.BoundedSemaphore(limit['concurrency'])
+                       for endpoint, limit in self.limits.items() if limit.get('concurrency')}
+        self._lock = threading.Lock()
+        self.counts = {endpoint: {'admitted': 0, 'busy': 0, 'rate_limited': 0} for endpoint in self.limits}
+        app.extensions['admission'] = self
+        app.before_request(self._admit)
+        app.teardown_request(self._release)
+
+    def _count(self, endpoint, outcome):
+        with self._lock:
+            self.counts[endpoint][outcome] += 1
+
+    def _reject(self, endpoint, outcome, status, message, retry_after):
+        self._count(endpoint, outcome)
+        response = jsonify(success=False, message=message)
+        response.status_code = status
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def _admit(self):
+        endpoint = request.endpoint
+        limit = self.limits.get(endpoint)
+        if limit is None or request.method not in limit.get('methods', ('POST',)):
+            return None
+        if limit.get('rate'):
+            wait = self.buckets.take(f'{endpoint}:{request.remote_addr}', limit['rate'],
+                                     limit.get('burst', 1), time.time())
+            if wait:
+                return self._reject(endpoint, 'rate_limited', 429,
+                                    'Too many requests. Please try again shortly.', wait)
+        slots = self._slots.get(endpoint)
+        if slots is not None:
+            if not slots.acquire(blocking=False):
+                return self._reject(endpoint, 'busy', 503,
+                                    'The server is busy. Please try again shortly.', 1)
+            g.admission_slot = slots
+        self._count(endpoint, 'admitted')
+        return None
+
+    def _release(self, error=None):
+        slots = g.pop('admission_slot', None)
+        if slots is not None:
+            slots.release()
+
+    def stats(self):
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self.counts.items()}
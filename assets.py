@@ -0,0 +1,130 @@
+import os
+import re
+import gzip
+import hashlib
+import mimetypes
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Only text assets are worth compressing; images are compressed already
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.map'}
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+# Uploads named by their SHA-256 (see PhotoStore) never change content
+HASHED_NAME = re.compile(r'^[0-9a-f]{64}(-[a-z]+)?\.[a-z0-9]+$')
+ONE_YEAR = 365 * 24 * 60 * 60
+
+
+def _compress(path, suffix):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if suffix == '.br':
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+class StaticAssets:
+    """Fingerprinted, precompressed static files served with immutable caching.
+
+    At startup every file under the static folder, except uploads, is hashed,
+    and url_for('static', filename='css/style.css') then produces
+    css/style.<hash>.css. Text assets get .gz (and .br when brotli is
+    installed) copies written next to them, rebuilt whenever the original is
+    newer. The static view serves fingerprinted and content-hashed URLs with
+    ``Cache-Control: immutable`` for a year and picks the best precompressed
+    copy the client's Accept-Encoding allows.
+    """
+
+    def __init__(self, app=None):
+        self.folder = None
+        self.fingerprints = {}
+        self.originals = {}
+        self.encodings = {}
+        self.modified = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STATIC_MAX_AGE', ONE_YEAR)
+        self.max_age = app.config['STATIC_MAX_AGE']
+        self.folder = app.static_folder
+        skip = os.path.abspath(os.path.join(app.root_path, app.config.get('UPLOAD_FOLDER', 'static/uploads')))
+        self.build(skip)
+        app.url_defaults(self._fingerprint)
+        app.view_functions['static'] = self.send
+        app.extensions['static_assets'] = self
+
+    def build(self, skip=None):
+        """Hashes the static files and writes missing or outdated compressed copies."""
+        suffixes = tuple(suffix for encoding, suffix in PRECOMPRESSED)
+        for root, dirs, files in os.walk(self.folder):
+            if skip and os.path.abspath(root) == skip:
+                dirs[:] = []
+                continue
+            for name in files:
+                if name.endswith(suffixes) or name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.folder).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()[:12]
+                    self.modified = max(self.modified, os.fstat(f.fileno()).st_mtime)
+                stem, ext = os.path.splitext(filename)
+                fingerprinted = f'{stem}.{digest}{ext}'
+                self.fingerprints[filename] = fingerprinted
+                self.originals[fingerprinted] = filename
+                if ext in COMPRESSIBLE:
+                    self.encodings[filename] = self._precompress(path)
+
+    @property
+    def version(self):
+        """A digest of every fingerprint, which changes whenever any static file does."""
+        return hashlib.sha256(repr(sorted(self.fingerprints.items())).encode('utf-8')).hexdigest()[:12]
+
+    def _precompress(self, path):
+        available = []
+        size = os.path.getsize(path)
+        for encoding, suffix in PRECOMPRESSED:
+            if suffix == '.br' and brotli is None:
+                continue
+            target = path + suffix
+            if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(path):
+                # Several workers may start at once; each writes its own temp file
+                tmp_path = f'{target}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(_compress(path, suffix))
+                os.replace(tmp_path, target)
+            if os.path.getsize(target) < size:
+                available.append((encoding, suffix))
+        return available
+
+    def _fingerprint(self, endpoint, values):
+        if endpoint == 'static':
+            filename = values.get('filename')
+            values['filename'] = self.fingerprints.get(filename, filename)
+
+    def send(self, filename):
+        original = self.originals.get(filename)
+        immutable = original is not None or HASHED_NAME.match(filename.rsplit('/', 1)[-1])
+        filename = original or filename
+        served = filename
+        encoding = None
+        for candidate, suffix in self.encodings.get(filename, ()):
+            if request.accept_encodings[candidate]:
+                served, encoding = filename + suffix, candidate
+                break
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(self.folder, served, mimetype=mimetype,
+                                       max_age=self.max_age if immutable else None)
+        if filename in self.encodings:
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
@@ -0,0 +1,331 @@
+"""Load test for the main routes against a synthetic catalog.
+
+For each catalog size it writes cars.json, users.json and a set of photos to
+a temporary directory and builds the app on them with create_app(). It then
+sends each scenario's requests through the WSGI app from a pool of threads
+and reports per-route throughput and p50/p95/p99 latency as JSON:
+
+    python bench.py --cars 1000,10000,100000 --concurrency 8 --output bench_output.txt
+    python bench.py --cars 10000 --compare bench_output.txt
+
+--compare prints how each route's p95 moved against an earlier report.
+"""
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from factory import create_app
+
+MAKES = {
+    'Maruti': ['Swift', 'Baleno', 'Dzire', 'Ertiga', 'Brezza'],
+    'Hyundai': ['i20', 'Creta', 'Verna', 'Venue'],
+    'Honda': ['City', 'Amaze', 'Jazz', 'WR-V'],
+    'Tata': ['Nexon', 'Harrier', 'Punch', 'Tiago'],
+    'Mahindra': ['XUV700', 'Scorpio', 'Thar', 'Bolero'],
+    'Toyota': ['Innova', 'Fortuner', 'Glanza'],
+}
+WORDS = 'single owner service history new tyres diesel petrol automatic manual sunroof alloy'.split()
+PASSWORD = 'bench-password'
+SCENARIOS = ['index', 'index_page', 'search', 'api_cars', 'api_car', 'login', 'upload', 'delete_car']
+
+
+def format_price(value):
+    """Indian digit grouping, as dealers type it: 5,25,000."""
+    digits = str(value)
+    head, tail = digits[:-3], digits[-3:]
+    groups = []
+    while len(head) > 2:
+        groups.insert(0, head[-2:])
+        head = head[:-2]
+    return ','.join(([head] if head else []) + groups + [tail])
+
+
+def make_photos(folder, count, rng):
+    """Writes count distinct JPEGs (or copies of the sample photo without Pillow)."""
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    sample = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'images', 'car1.jpeg')
+    names = []
+    for i in range(count):
+        name = f'bench-{i}.jpg'
+        if Image is None:
+            shutil.copy(sample, os.path.join(folder, name))
+        else:
+            color = tuple(rng.randrange(256) for _ in range(3))
+            Image.new('RGB', (1280, 960), color).save(os.path.join(folder, name), 'JPEG', quality=85)
+        names.append(name)
+    return names
+
+
+def make_catalog(directory, cars, users, photos, seed=0):
+    """Writes a synthetic catalog to directory and returns the config pointing at it."""
+    rng = random.Random(seed)
+    upload_folder = os.path.join(directory, 'uploads')
+    os.makedirs(upload_folder)
+    photo_names = make_photos(upload_folder, photos, rng)
+
+    now = time.time()
+    catalog = []
+    for i in range(cars):
+        make = rng.choice(list(MAKES))
+        catalog.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'make': make,
+            'model': rng.choice(MAKES[make]),
+            'year': str(rng.randint(2005, 2024)),
+            'price': format_price(rng.randrange(150, 4000) * 1000),
+            'details': ' '.join(rng.sample(WORDS, 4)),
+            'photos': rng.sample(photo_names, min(3, len(photo_names))),
+            'photo_variants': [],
+            'created_at': now - i * 60,
+        })
+    # Every user shares one hash, so generating users costs a single bcrypt run
+    rounds = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    hashed = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    accounts = {f'user{i}': {'password': hashed} for i in range(users)}
+
+    paths = {name: os.path.join(directory, name) for name in ('cars.json', 'users.json', 'photos.json')}
+    with open(paths['cars.json'], 'w') as f:
+        json.dump(catalog, f)
+    with open(paths['users.json'], 'w') as f:
+        json.dump(accounts, f)
+    with open(paths['photos.json'], 'w') as f:
+        json.dump({}, f)
+    config = {
+        'TESTING': True,
+        'CSRF_ENABLED': False,
+        'STORAGE_BACKEND': 'json',
+        'UPLOAD_FOLDER': upload_folder,
+        'CARS_DATA_FILE': paths['cars.json'],
+        'USERS_DATA_FILE': paths['users.json'],
+        'PHOTOS_DATA_FILE': paths['photos.json'],
+        'CONTACTS_INBOX_FILE': os.path.join(directory, 'contacts.jsonl'),
+        'CONTACTS_DATA_FILE': os.path.join(directory, 'contacts.json'),
+        'JINJA_BYTECODE_CACHE': os.path.join(directory, 'jinja_cache'),
+    }
+    return config, catalog, [os.path.join(upload_folder, name) for name in photo_names]
+
+
+class Scenario:
+    """Builds the request for the n-th call of one route."""
+
+    def __init__(self, name, catalog, photo_paths, users, rng):
+        self.name = name
+        self.catalog = catalog
+        self.photos = [open(path, 'rb').read() for path in photo_paths[:5]]
+        self.users = users
+        self.rng = rng
+        self.delete_ids = [car['id'] for car in catalog]
+        rng.shuffle(self.delete_ids)
+        self.lock = threading.Lock()
+        self.cursors = []
+
+    def needs_login(self):
+        return self.name in ('upload', 'delete_car')
+
+    def request(self, client, n):
+        if self.name == 'index':
+            return client.get('/')
+        if self.name == 'index_page':
+            # Walk a few pages deep using the cursors the API hands out
+            with self.lock:
+                cursor = self.cursors[n % len(self.cursors)] if self.cursors else None
+            return client.get('/', query_string={'after': cursor} if cursor else None)
+        if self.name == 'search':
+            car = self.catalog[n % len(self.catalog)]
+            return client.get('/', query_string={'q': car['model'], 'year_min': '2010'})
+        if self.name == 'api_cars':
+            return client.get('/api/cars', query_string={'q': self.rng.choice(list(MAKES))})
+        if self.name == 'api_car':
+            return client.get(f"/api/cars/{self.catalog[n % len(self.catalog)]['id']}")
+        if self.name == 'login':
+            return client.post('/login', data={'username': f'user{n % self.users}', 'password': PASSWORD})
+        if self.name == 'upload':
+            make = self.rng.choice(list(MAKES))
+            return client.post('/upload', content_type='multipart/form-data', data={
+                'make': make, 'model': MAKES[make][0], 'year': '2019', 'price': '5,00,000',
+                'details': 'bench upload',
+                'photos': [(io.BytesIO(self.photos[n % len(self.photos)]), 'photo.jpg')],
+            })
+        if self.name == 'delete_car':
+            with self.lock:
+                car_id = self.delete_ids.pop() if self.delete_ids else 'missing'
+            return client.post(f'/delete_car/{car_id}')
+        raise ValueError(self.name)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def succeeded(response):
+    """False for error statuses and for JSON answers such as /login's and
+    /upload's, which report a failure as 200 with success: false."""
+    if response.status_code >= 400:
+        return False
+    body = response.get_json(silent=True)
+    return not (isinstance(body, dict) and body.get('success') is False)
+
+
+def run_scenario(app, scenario, requests, concurrency, warmup):
+    clients = threading.local()
+
+    def client():
+        if not hasattr(clients, 'client'):
+            clients.client = app.test_client()
+            if scenario.needs_login():
+                response = clients.client.post('/login', data={'username': 'user0', 'password': PASSWORD})
+                if not succeeded(response):
+                    raise RuntimeError(f'{scenario.name}: could not log in as user0')
+        return clients.client
+
+    def call(n):
+        c = client()
+        started = time.perf_counter()
+        response = scenario.request(c, n)
+        elapsed = time.perf_counter() - started
+        status = response.status_code
+        ok = succeeded(response)
+        response.close()
+        return elapsed, status, ok
+
+    for n in range(warmup):
+        call(n)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(call, range(warmup, warmup + requests)))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed for elapsed, status, ok in results)
+    statuses = {}
+    for elapsed, status, ok in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': requests,
+        'throughput_rps': round(requests / wall, 2) if wall else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3),
+        'statuses': statuses,
+        'failures': sum(not ok for elapsed, status, ok in results),
+    }
+
+
+def collect_cursors(app, scenario, pages=5):
+    client = app.test_client()
+    cursor = None
+    for _ in range(pages):
+        body = client.get('/api/cars', query_string={'after': cursor} if cursor else None).get_json()
+        cursor = body.get('next_cursor')
+        if not cursor:
+            break
+        scenario.cursors.append(cursor)
+
+
+def run_scale(cars, args):
+    directory = tempfile.mkdtemp(prefix='bench-')
+    try:
+        setup_started = time.perf_counter()
+        config, catalog, photo_paths = make_catalog(directory, cars, args.users, args.photos, args.seed)
+        config['PASSWORD_HASH_WORKERS'] = args.hash_workers
+        config['ADMISSION_CONTROL'] = args.admission_control
+        app = create_app(config)
+        setup_seconds = time.perf_counter() - setup_started
+        routes = {}
+        for name in args.routes:
+            scenario = Scenario(name, catalog, photo_paths, args.users, random.Random(args.seed))
+            if name == 'index_page':
+                collect_cursors(app, scenario)
+            requests = min(args.requests, len(catalog)) if name == 'delete_car' else args.requests
+            routes[name] = run_scenario(app, scenario, requests, args.concurrency, args.warmup)
+            print(f'  {cars} cars  {name:<11} {routes[name]["throughput_rps"]:>9} req/s  '
+                  f'p50 {routes[name]["p50_ms"]:>8} ms  p95 {routes[name]["p95_ms"]:>8} ms  '
+                  f'p99 {routes[name]["p99_ms"]:>8} ms  failures {routes[name]["failures"]}', file=sys.stderr)
+        return {'cars': cars, 'setup_seconds': round(setup_seconds, 3),
+                'startup': app.config['STARTUP_TIMES'], 'routes': routes}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {scale['cars']: scale for scale in json.load(f)['scales']}
+    for scale in report['scales']:
+        before = baseline.get(scale['cars'])
+        if before is None:
+            continue
+        for name, result in scale['routes'].items():
+            old = before['routes'].get(name)
+            if old and old['p95_ms']:
+                change = (result['p95_ms'] - old['p95_ms']) / old['p95_ms'] * 100
+                print(f'{scale["cars"]:>7} cars  {name:<11} p95 {old["p95_ms"]:>8} -> {result["p95_ms"]:>8} ms '
+                      f'({change:+.1f}%)', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cars', default='1000', help='comma-separated catalog sizes, e.g. 1000,10000,100000')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--photos', type=int, default=20, help='distinct photo files to generate')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per route first')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--hash-workers', type=int, default=2, help='PASSWORD_HASH_WORKERS for the app')
+    parser.add_argument('--admission-control', action='store_true',
+                        help='keep the login/upload limits on (rejected requests show up as 429/503)')
+    parser.add_argument('--routes', default=','.join(SCENARIOS), help='comma-separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON report to compare p95 latencies against')
+    args = parser.parse_args(argv)
+    args.routes = [name for name in args.routes.split(',') if name]
+    unknown = set(args.routes) - set(SCENARIOS)
+    if unknown:
+        parser.error('unknown routes: ' + ', '.join(sorted(unknown)))
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'concurrency': args.concurrency,
+        'scales': [run_scale(int(cars), args) for cars in args.cars.split(',')],
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import io
+import csv
+import json
+import time
+
+from werkzeug.datastructures import MultiDict
+
+# Columns read from an import; a CSV export adds the id and upload time
+IMPORT_FIELDS = ('make', 'model', 'year', 'price', 'details')
+EXPORT_FIELDS = ('id',) + IMPORT_FIELDS + ('created_at',)
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+EXPORT_CHUNK_ROWS = 100
+
+
+def format_from_name(name):
+    """'csv' or 'jsonl' for a file name or format name, or None."""
+    ext = (name or '').lower().rsplit('.', 1)[-1]
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(ext)
+
+
+def read_rows(stream, fmt):
+    """Yields (line number, row) from a binary CSV or JSONL stream, one row at a time.
+
+    The row is a dict, or None for a JSONL line that is not a JSON object.
+    """
+    if not hasattr(stream, 'read1'):
+        stream = io.BufferedReader(stream)
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text)
+        missing = [field for field in IMPORT_FIELDS if field not in (reader.fieldnames or ())]
+        if missing:
+            raise ValueError(f'The CSV header has no {", ".join(missing)} column.')
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def validate_rows(rows, form_class, new_id):
+    """Checks each row with form_class, the upload form; returns (cars, errors).
+
+    Rows are validated as they are read, so only the accepted cars are kept
+    in memory. Imported cars have no photos. created_at follows the file
+    order, so the last row is listed first, as if the rows had been uploaded
+    one after another.
+    """
+    cars, errors = [], []
+    now = time.time()
+    for number, row in rows:
+        if row is None:
+            errors.append(f'Line {number}: not a JSON object.')
+            continue
+        formdata = MultiDict((field, '' if row.get(field) is None else str(row[field]).strip())
+                             for field in IMPORT_FIELDS)
+        form = form_class(formdata=formdata, meta={'csrf': False})
+        if not form.validate():
+            problems = '; '.join(f'{field}: {" ".join(messages)}' for field, messages in form.errors.items())
+            errors.append(f'Line {number}: {problems}')
+            continue
+        cars.append({
+            'id': new_id(),
+            'make': form.make.data,
+            'model': form.model.data,
+            'year': form.year.data,
+            'price': form.price.data,
+            'details': form.details.data,
+            'photos': [],
+            'photo_variants': [],
+            'created_at': now + len(cars) * 1e-6,
+        })
+    return cars, errors
+
+
+def export_chunks(cars, fmt):
+    """Yields the cars as CSV or JSONL text, a few rows per chunk."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(EXPORT_FIELDS)
+    for count, car in enumerate(cars, 1):
+        if writer:
+            writer.writerow(['' if car.get(field) is None else car[field] for field in EXPORT_FIELDS])
+        else:
+            buffer.write(json.dumps(car, ensure_ascii=False) + '\n')
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
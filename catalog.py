@@ -0,0 +1,102 @@
+import uuid
+
+from listing import NewestFirst
+from search import CatalogIndex
+from fragments import FragmentCache
+from http_cache import etag_for
+
+
+class Catalog:
+    """The car listings with the search index, page order and card cache kept beside them.
+
+    Writes go through add() and remove() so the index and the cached cards
+    follow the store. remove() also releases the car's photos.
+    """
+
+    def __init__(self, store, photo_store):
+        self.store = store
+        self.photo_store = photo_store
+        self.index = CatalogIndex()
+        self.newest_first = NewestFirst()
+        self.cards = FragmentCache('car_card.html')
+
+    def load(self):
+        # Shared cached list: treat as read-only
+        return self.store.load()
+
+    def iterate(self):
+        """Yields every car without building a new list."""
+        return self.store.iterate()
+
+    def get(self, car_id):
+        """The car with this id, looked up in the store's id index, or None."""
+        return self.store.get(str(car_id))
+
+    @staticmethod
+    def new_id():
+        """A fresh car id. Ids are random, so every worker can allocate them
+        without coordination and an id is never handed out again after a delete."""
+        return str(uuid.uuid4())
+
+    def add(self, car):
+        generation = self.store.generation
+        self.store.put(car['id'], car)
+        self.index.add(car, generation, self.store.generation)
+        self.cards.invalidate(car['id'])
+
+    def add_many(self, cars):
+        """Adds cars with a single store write."""
+        generation = self.store.generation
+        self.store.put_many((car['id'], car) for car in cars)
+        self.index.add_many(cars, generation, self.store.generation)
+        for car in cars:
+            self.cards.invalidate(car['id'])
+
+    def remove(self, car_id):
+        """Deletes a car and releases its photos; returns the deleted record or None."""
+        removed = self.remove_many([car_id])
+        return removed[0] if removed else None
+
+    def remove_many(self, car_ids):
+        """Deletes cars with a single store write and releases their photos; returns the deleted records."""
+        generation = self.store.generation
+        car_ids = [str(car_id) for car_id in car_ids]
+        cars = self.store.delete_many(car_ids)
+        self.index.remove_many([str(car['id']) for car in cars], generation, self.store.generation)
+        for car in cars:
+            self.cards.invalidate(car['id'])
+        # Delete image files no other listing uses
+        photos = []
+        for car in cars:
+            variants = car.get('photo_variants') or []
+            for i, photo_filename in enumerate(car['photos']):
+                photos.append((photo_filename, variants[i] if i < len(variants) else None))
+        if photos:
+            self.photo_store.release_many(photos)
+        return cars
+
+    def find(self, filters):
+        """Returns the cars matching the search filters, or the whole catalog if none are set."""
+        if not any(value is not None for value in filters.values()):
+            return self.load()
+        self.index.sync(self.store)
+        return self.index.search(**filters)
+
+    def page(self, cars, cursor, page_size):
+        generation = self.store.generation
+        if cars is self.load():
+            # The whole catalog, as find() returns it with no filters set
+            return self.newest_first.page(cars, cursor, page_size, generation)
+        return self.newest_first.page(cars, cursor, page_size)
+
+    def validators(self, *parts, not_before=None):
+        """ETag and Last-Modified for a response built from the catalog.
+
+        Pages rendered from templates pass the templates' own modification
+        time as not_before, so a deploy with no data change still moves
+        Last-Modified on.
+        """
+        last_modified = self.store.last_modified
+        if not_before is not None:
+            last_modified = max(last_modified or 0, not_before)
+        return etag_for(*parts, self.store.version), last_modified
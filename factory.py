@@ -0,0 +1,241 @@
+import os
+import time
+
+_import_started = time.perf_counter()
+import click
+from flask import Flask
+from jinja2 import FileSystemBytecodeCache
+FLASK_IMPORT_SECONDS = time.perf_counter() - _import_started
+
+
+class DefaultConfig:
+    # Load secret key from an environment variable in production
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your_very_secure_secret_key_here')
+
+    # Features
+    CSRF_ENABLED = True
+    # How register and login answer a submitted form: 'json' or 'form' (flash and redirect)
+    RESPONSE_FORMAT = 'json'
+    CONTACT_FORM = True
+    # Request and span timings at /metrics
+    METRICS_ENABLED = True
+    # Per endpoint: requests handled at once by each worker process, and a token bucket
+    # per client address (rate per second, burst); see admission.AdmissionControl
+    ADMISSION_CONTROL = True
+    ADMISSION_LIMITS = {
+        'login': {'concurrency': 4, 'rate': 0.2, 'burst': 10},
+        'register': {'concurrency': 2, 'rate': 0.05, 'burst': 5},
+        'upload': {'concurrency': 2, 'rate': 0.5, 'burst': 10},
+        'upload_photo': {'concurrency': 4, 'rate': 2, 'burst': 30},
+        'import_cars': {'concurrency': 1, 'rate': 0.1, 'burst': 3},
+    }
+    # Set to a file path to share the token buckets between worker processes
+    ADMISSION_STATE_FILE = os.environ.get('ADMISSION_STATE_FILE')
+    # Requests sent with the header X-Profile: <PROFILER_SECRET> are profiled into PROFILER_DIR
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED') == '1'
+    PROFILER_SECRET = os.environ.get('PROFILER_SECRET', '')
+    PROFILER_DIR = os.environ.get('PROFILER_DIR', 'profiles')
+
+    # Configuration for file uploads
+    UPLOAD_FOLDER = 'static/uploads'
+    MAX_CONTENT_LENGTH = 64 * 1024 * 1024
+    MAX_PHOTO_SIZE = 16 * 1024 * 1024
+    # Unreferenced uploads older than the grace period are deleted by `flask gc-uploads`,
+    # and every UPLOAD_GC_INTERVAL seconds in the background when it is set
+    UPLOAD_GC_GRACE_PERIOD = 3600
+    UPLOAD_GC_BATCH_SIZE = 500
+    UPLOAD_GC_INTERVAL = int(os.environ.get('UPLOAD_GC_INTERVAL', 0))
+
+    CARS_PER_PAGE = 24
+    CONTACTS_PER_PAGE = 50
+
+    # Local database files
+    CARS_DATA_FILE = 'cars.json'
+    USERS_DATA_FILE = 'users.json'
+    PHOTOS_DATA_FILE = 'photos.json'
+    # Contact messages: append-only log; contacts.json is imported into it once
+    CONTACTS_INBOX_FILE = 'contacts.jsonl'
+    CONTACTS_DATA_FILE = 'contacts.json'
+
+    # Storage backend: 'json' (files above) or 'sqlite'
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+    SQLITE_DATABASE = os.environ.get('SQLITE_DATABASE', 'cars.db')
+
+    # bcrypt cost and the number of processes hashing passwords
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+
+    # Compiled templates are kept here (default: <instance folder>/jinja_cache); False disables it
+    JINJA_BYTECODE_CACHE = None
+
+
+def open_json_stores(config):
+    from storage import JournaledStore
+    return (JournaledStore(config['CARS_DATA_FILE'], key_field='id'),
+            JournaledStore(config['USERS_DATA_FILE'], as_dict=True),
+            JournaledStore(config['PHOTOS_DATA_FILE'], as_dict=True))
+
+
+def open_stores(config):
+    if config['STORAGE_BACKEND'] == 'sqlite':
+        from storage_sqlite import open_sqlite_stores
+        return open_sqlite_stores(config['SQLITE_DATABASE'])
+    return open_json_stores(config)
+
+
+def create_app(config=None):
+    """Builds the application from DefaultConfig updated with config.
+
+    Optional parts (CSRF protection, the contact form and inbox) are only set
+    up when enabled, and form classes, Pillow and bcrypt are imported when
+    first needed. How long start-up took is logged and kept in
+    app.config['STARTUP_TIMES'].
+    """
+    started = time.perf_counter()
+    app = Flask(__name__)
+    app.config.from_object(DefaultConfig)
+    if config:
+        app.config.from_mapping(config)
+
+    cache_dir = app.config['JINJA_BYTECODE_CACHE']
+    if cache_dir is not False:
+        cache_dir = cache_dir or os.path.join(app.instance_path, 'jinja_cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(cache_dir))
+
+    imports_started = time.perf_counter()
+    from flask_login import LoginManager
+    import views
+    from photos import PhotoStore, UploadRequest
+    from users import UserDirectory
+    from passwords import PasswordHasher
+    from catalog import Catalog
+    from assets import StaticAssets
+    from upload_gc import UploadCollector
+    imports_seconds = time.perf_counter() - imports_started
+
+    app.request_class = UploadRequest
+    if app.config['METRICS_ENABLED']:
+        from metrics import Metrics
+        Metrics(app)
+    if app.config['PROFILER_ENABLED']:
+        from profiling import RequestProfiler
+        RequestProfiler(app)
+    if app.config['ADMISSION_CONTROL']:
+        # Before CSRF protection, which parses the form (and spools uploads) to find the token
+        from admission import AdmissionControl
+        AdmissionControl(app)
+    PasswordHasher(app)
+    login_manager = LoginManager(app)
+    login_manager.login_view = 'login'
+    login_manager.user_loader(views.load_user)
+    if app.config['CSRF_ENABLED']:
+        from flask_wtf.csrf import CSRFProtect
+        csrf = CSRFProtect(app)
+        csrf.exempt(views.delete_car)
+    else:
+        app.config['WTF_CSRF_ENABLED'] = False
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    # Fingerprinted URLs and precompressed copies for everything under static/
+    StaticAssets(app)
+
+    cars_store, users_store, photo_refs_store = open_stores(app.config)
+    app.extensions['catalog'] = Catalog(cars_store, PhotoStore(app.config['UPLOAD_FOLDER'], photo_refs_store))
+    app.extensions['user_directory'] = UserDirectory(users_store)
+    app.extensions['upload_gc'] = UploadCollector(app.extensions['catalog'],
+                                                  grace_period=app.config['UPLOAD_GC_GRACE_PERIOD'],
+                                                  batch_size=app.config['UPLOAD_GC_BATCH_SIZE'])
+    if app.config['UPLOAD_GC_INTERVAL']:
+        # Started from the first request, so each worker process runs its own thread
+        app.before_request(lambda: app.extensions['upload_gc'].start(app.config['UPLOAD_GC_INTERVAL']))
+    if app.config['CONTACT_FORM']:
+        from inbox import ContactInbox
+        app.extensions['contact_inbox'] = ContactInbox(app.config['CONTACTS_INBOX_FILE'],
+                                                       legacy_path=app.config['CONTACTS_DATA_FILE'])
+
+    # Part of the listing page ETags, so a template or static file change invalidates
+    # cached pages (which link to the fingerprinted CSS and JS)
+    templates_mtime = max(
+        os.path.getmtime(os.path.join(app.root_path, 'templates', name))
+        for name in ('index.html', 'car_card.html', 'car.html'))
+    app.config['TEMPLATE_VERSION'] = f'{int(templates_mtime)}.{app.extensions["static_assets"].version}'
+    # Likewise the earliest Last-Modified those pages report, for clients that
+    # revalidate with If-Modified-Since alone
+    app.config['TEMPLATE_MODIFIED'] = max(templates_mtime, app.extensions['static_assets'].modified)
+
+    views.init_app(app)
+    register_commands(app)
+
+    app.config['STARTUP_TIMES'] = {
+        'flask_import_seconds': round(FLASK_IMPORT_SECONDS, 4),
+        'app_import_seconds': round(imports_seconds, 4),
+        'create_app_seconds': round(time.perf_counter() - started, 4),
+        # CPU time since the interpreter started, imports included
+        'process_cpu_seconds': round(time.process_time(), 4),
+    }
+    app.logger.info('Application ready: %s', app.config['STARTUP_TIMES'])
+    return app
+
+
+def register_commands(app):
+    @app.cli.command('migrate-json')
+    def migrate_json_command():
+        """Imports cars.json, users.json and photos.json into the SQLite database."""
+        from storage_sqlite import open_sqlite_stores, migrate_json
+        counts = migrate_json(open_json_stores(app.config), open_sqlite_stores(app.config['SQLITE_DATABASE']))
+        for table, count in counts:
+            click.echo(f'{table}: {count} rows imported into {app.config["SQLITE_DATABASE"]}')
+
+    @app.cli.command('import-cars')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Default: from the file name.')
+    def import_cars_command(path, fmt):
+        """Adds the cars in a CSV or JSONL file in a single write, if every row is valid."""
+        import csv
+        from bulk import format_from_name, read_rows, validate_rows
+        from forms import UploadForm
+        fmt = fmt or format_from_name(path)
+        if fmt is None:
+            raise click.UsageError('Cannot tell the format from the file name; pass --format.')
+        catalog = app.extensions['catalog']
+        with open(path, 'rb') as f:
+            try:
+                cars, errors = validate_rows(read_rows(f, fmt), UploadForm, catalog.new_id)
+            except (ValueError, csv.Error) as error:
+                raise click.ClickException(f'Could not read {path}: {error}')
+        if errors:
+            for error in errors:
+                click.echo(error, err=True)
+            raise click.ClickException(f'{len(errors)} rows are invalid; nothing was imported.')
+        catalog.add_many(cars)
+        click.echo(f'{len(cars)} cars imported.')
+
+    @app.cli.command('export-cars')
+    @click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv')
+    @click.option('--output', type=click.File('w', encoding='utf-8'), default='-')
+    def export_cars_command(fmt, output):
+        """Writes every car as CSV or JSONL."""
+        from bulk import export_chunks
+        for chunk in export_chunks(app.extensions['catalog'].iterate(), fmt):
+            output.write(chunk)
+
+    @app.cli.command('gc-uploads')
+    @click.option('--dry-run', is_flag=True, help='List the files that would be deleted.')
+    @click.option('--grace-period', type=int, help='Keep files younger than this many seconds.')
+    def gc_uploads_command(dry_run, grace_period):
+        """Deletes uploaded files that no car refers to."""
+        collector = app.extensions['upload_gc']
+        if grace_period is not None:
+            collector.grace_period = grace_period
+        found = collector.run(dry_run=dry_run)
+        if found is None:
+            click.echo('Another process is collecting uploads; nothing done.')
+            return
+        for name in found:
+            click.echo(name)
+        stats = collector.stats()
+        if dry_run:
+            click.echo(f'{len(found)} unreferenced files; nothing deleted.')
+        else:
+            click.echo(f'{stats["deleted"]} files deleted, {stats["bytes_freed"]} bytes freed.')
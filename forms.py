@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, TextAreaField
+from wtforms import StringField, PasswordField, SubmitField, TextAreaField, MultipleFileField
 from wtforms.validators import DataRequired, Email, Length
 
 class RegistrationForm(FlaskForm):
@@ -18,6 +18,7 @@ class UploadForm(FlaskForm):
     year = StringField('Year', validators=[DataRequired()])
     price = StringField('Price', validators=[DataRequired()])
     details = TextAreaField('Details', validators=[DataRequired()])
+    photos = MultipleFileField('Photos')
     submit = SubmitField('Upload Car')
 
 class ContactForm(FlaskForm):
@@ -0,0 +1,64 @@
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from markupsafe import Markup
+
+# Stands in for the per-session CSRF token inside cached fragments; the page
+# swaps the real token in after assembly. Only the whole attribute is
+# replaced: listing text is HTML-escaped, so it can never contain the quotes.
+CSRF_PLACEHOLDER = '__csrf_token__'
+CSRF_ATTRIBUTE = f'value="{CSRF_PLACEHOLDER}"'
+
+
+def fill_csrf_token(html, token):
+    return html.replace(CSRF_ATTRIBUTE, f'value="{token}"')
+
+
+class FragmentCache:
+    """Rendered HTML of each car card, reused across index pages.
+
+    Entries are keyed by car id and whether the viewer is logged in, since
+    only logged-in viewers get the delete form. An entry is reused while the
+    stored record is the same object, or equal to the one it was rendered
+    from, so a card edited by another worker is re-rendered too. The card
+    template gets only the car and the login flag, never the request, so a
+    fragment cannot pick up anything specific to one visitor. At most
+    ``max_entries`` cards are kept, least recently used first out.
+    """
+
+    def __init__(self, template_name, max_entries=10000):
+        self.template_name = template_name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, car, authenticated):
+        key = (str(car.get('id')), authenticated)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is car or entry[0] == car):
+                self._entries.move_to_end(key)
+                self._entries[key] = (car, entry[1])
+                self.hits += 1
+                return entry[1]
+        template = current_app.jinja_env.get_template(self.template_name)
+        html = Markup(template.render(car=car, authenticated=authenticated,
+                                      csrf_placeholder=CSRF_PLACEHOLDER))
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (car, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def invalidate(self, car_id):
+        with self._lock:
+            for authenticated in (False, True):
+                self._entries.pop((str(car_id), authenticated), None)
+
+    def stats(self):
+        return {'fragments': len(self._entries), 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,26 @@
+from datetime import datetime, timezone
+
+from flask import request
+
+
+def etag_for(*parts):
+    return '-'.join(str(part) for part in parts)
+
+
+def is_not_modified(etag, last_modified=None):
+    """True if the request's If-None-Match or If-Modified-Since header still matches."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        # HTTP dates only carry whole seconds
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def set_validators(response, etag, last_modified=None):
+    """Lets clients keep the response but makes them revalidate it on every use."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = datetime.fromtimestamp(int(last_modified), timezone.utc)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
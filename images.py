@@ -0,0 +1,65 @@
+import os
+import logging
+
+log = logging.getLogger(__name__)
+
+# Pillow is optional (photos are then served as uploaded) and imported on
+# first use, since it is slow to import
+Image = ImageOps = None
+_pillow_missing = False
+
+# Longest edge in pixels for each derivative
+VARIANT_SIZES = {'thumb': 320, 'card': 640, 'full': 1600}
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = 'webp'
+VARIANT_QUALITY = 80
+
+
+def _load_pillow():
+    global Image, ImageOps, _pillow_missing
+    if Image is None and not _pillow_missing:
+        try:
+            from PIL import Image, ImageOps
+        except ImportError:
+            _pillow_missing = True
+    return Image is not None
+
+
+def make_variants(source_path, stem, sizes=VARIANT_SIZES):
+    """Writes resized, metadata-free copies of a photo next to it.
+
+    Returns {variant: {'file': filename, 'width': pixels}}, or an empty dict
+    if Pillow is not installed, the file cannot be read as an image or a
+    variant cannot be written (no WebP support, a full disk). The photo is
+    then served as uploaded.
+    """
+    if not _load_pillow():
+        return {}
+    folder = os.path.dirname(source_path)
+    try:
+        with Image.open(source_path) as original:
+            # Apply the EXIF rotation before the EXIF block is dropped
+            image = ImageOps.exif_transpose(original)
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return {}
+
+    variants = {}
+    for name, size in sizes.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        filename = f'{stem}-{name}.{VARIANT_EXTENSION}'
+        try:
+            resized.save(os.path.join(folder, filename), VARIANT_FORMAT,
+                         quality=VARIANT_QUALITY, method=4)
+        except (OSError, ValueError, KeyError):
+            # Pillow raises KeyError for a format it was built without
+            log.warning('Could not write %s variants of %s', VARIANT_FORMAT, source_path, exc_info=True)
+            for written in [filename] + [variant['file'] for variant in variants.values()]:
+                try:
+                    os.remove(os.path.join(folder, written))
+                except FileNotFoundError:
+                    pass
+            return {}
+        variants[name] = {'file': filename, 'width': resized.width}
+    return variants
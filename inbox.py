@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import queue
+import atexit
+import struct
+import logging
+import threading
+
+from storage import file_lock
+
+log = logging.getLogger(__name__)
+
+OFFSET = struct.Struct('<Q')
+_STOP = object()
+# After a failed write, submit() turns messages away for this many seconds before trying again
+RETRY_AFTER_FAILURE = 30.0
+
+
+class ContactInbox:
+    """Contact form messages kept in an append-only JSON Lines file.
+
+    submit() only puts the message on a bounded queue. A background thread
+    writes queued messages in batches, one write() per batch, and fsyncs after
+    ``batch_size`` messages or ``sync_interval`` seconds, whichever comes
+    first. Next to the data file, ``<path>.idx`` holds the byte offset of every
+    line as a fixed-width integer, so page() seeks straight to the messages it
+    needs instead of reading the whole inbox.
+
+    If a batch cannot be written (a full disk, say), the error is logged and
+    submit() returns False for RETRY_AFTER_FAILURE seconds, so visitors are
+    told their message was not sent rather than losing it silently.
+
+    If ``legacy_path`` names the old contacts.json array and the inbox is
+    still empty, its messages are imported once.
+    """
+
+    def __init__(self, path, legacy_path=None, batch_size=100, sync_interval=1.0, max_queue=10000):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.max_queue = max_queue
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._queue = None
+        self._failed_at = None
+        self._data = None
+        self._index = None
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.fsyncs = 0
+        self.failed = 0
+        if legacy_path:
+            self._import_legacy(legacy_path)
+        atexit.register(self.close)
+
+    def _import_legacy(self, legacy_path):
+        # Checked and imported under the flock, so workers starting together import it once
+        self._open_files()
+        with file_lock(self._data):
+            if os.fstat(self._data.fileno()).st_size:
+                return
+            try:
+                with open(legacy_path, 'r') as f:
+                    messages = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                return
+            if messages:
+                self._append(messages)
+                self._sync()
+
+    # Writing
+
+    def _open_files(self):
+        if self._data is None:
+            self._data = open(self.path, 'ab', buffering=0)
+            self._index = open(self.index_path, 'ab', buffering=0)
+
+    def _close_files(self):
+        if self._data is not None:
+            self._data.close()
+            self._index.close()
+            self._data = self._index = None
+
+    def _indexed_end(self):
+        """Byte offset just past the last line listed in the index."""
+        index_size = os.fstat(self._index.fileno()).st_size
+        if index_size < OFFSET.size:
+            return 0
+        with open(self.index_path, 'rb') as index, open(self.path, 'rb') as data:
+            index.seek(index_size - index_size % OFFSET.size - OFFSET.size)
+            (offset,) = OFFSET.unpack(index.read(OFFSET.size))
+            data.seek(offset)
+            return offset + len(data.readline())
+
+    def _repair(self):
+        """Indexes lines another writer added without indexing and drops a torn
+        last line or index entry."""
+        index_size = os.fstat(self._index.fileno()).st_size
+        if index_size % OFFSET.size:
+            # Later offsets would be written out of step with the 8-byte entries
+            os.truncate(self.index_path, index_size - index_size % OFFSET.size)
+        end = self._indexed_end()
+        size = os.fstat(self._data.fileno()).st_size
+        if end == size:
+            return
+        offsets = []
+        with open(self.path, 'rb') as data:
+            data.seek(end)
+            for line in data:
+                if not line.endswith(b'\n'):
+                    break
+                offsets.append(end)
+                end += len(line)
+        if offsets:
+            self._index.write(b''.join(OFFSET.pack(offset) for offset in offsets))
+        if end < size:
+            os.truncate(self.path, end)
+
+    def _append(self, messages):
+        """Writes messages and their offsets; the caller holds the flock."""
+        lines = [(json.dumps(message) + '\n').encode('utf-8') for message in messages]
+        self._repair()
+        offset = os.fstat(self._data.fileno()).st_size
+        offsets = []
+        for line in lines:
+            offsets.append(offset)
+            offset += len(line)
+        self._data.write(b''.join(lines))
+        self._index.write(b''.join(OFFSET.pack(offset) for offset in offsets))
+        self.written += len(messages)
+        self.batches += 1
+        self._unsynced += len(messages)
+
+    def _write_batch(self, messages):
+        self._open_files()
+        with file_lock(self._data):
+            self._append(messages)
+
+    def _sync(self):
+        if self._data is not None and self._unsynced:
+            os.fsync(self._data.fileno())
+            os.fsync(self._index.fileno())
+            self.fsyncs += 1
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def _run(self, messages):
+        while True:
+            try:
+                message = messages.get(timeout=self.sync_interval)
+            except queue.Empty:
+                self._guarded(self._sync, self._unsynced)
+                continue
+            batch = [message]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(messages.get_nowait())
+                except queue.Empty:
+                    break
+            stop = _STOP in batch
+            batch = [message for message in batch if message is not _STOP]
+            try:
+                if batch and self._guarded(lambda: self._write_batch(batch), len(batch)):
+                    self._failed_at = None
+                if stop or self._unsynced >= self.batch_size or \
+                        time.monotonic() - self._synced_at >= self.sync_interval:
+                    self._guarded(self._sync, self._unsynced)
+            finally:
+                for _ in range(len(batch) + stop):
+                    messages.task_done()
+            if stop:
+                return
+
+    def _guarded(self, write, count):
+        """Runs a write or sync; returns False, after logging, instead of letting
+        an error end the writer thread."""
+        try:
+            write()
+            return True
+        except Exception:
+            log.exception('Could not write %d contact message(s) to %s', count, self.path)
+            self.failed += count
+            self._failed_at = time.monotonic()
+            self._unsynced = 0
+            # Reopen on the next batch, in case the handles are what broke
+            try:
+                self._close_files()
+            except OSError:
+                self._data = self._index = None
+            return False
+
+    def _ensure_writer(self):
+        # A forked worker does not inherit the thread, so start one per process
+        # and start a new one if this process's writer has died
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._close_files()
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def submit(self, message, timeout=1.0):
+        """Queues a message for writing; returns False if the queue stayed full
+        or writing has been failing."""
+        if self._failed_at is not None and time.monotonic() - self._failed_at < RETRY_AFTER_FAILURE:
+            self.dropped += 1
+            return False
+        self._ensure_writer()
+        try:
+            self._queue.put(message, timeout=timeout)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def flush(self):
+        """Blocks until every queued message is written and fsynced."""
+        # A dead writer would leave the join waiting forever
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.join()
+            self._queue.put(_STOP)
+            self._queue.join()
+            self._pid = None
+
+    def close(self):
+        self.flush()
+        if self._pid is None:
+            self._close_files()
+
+    # Reading
+
+    def count(self):
+        try:
+            return os.path.getsize(self.index_path) // OFFSET.size
+        except FileNotFoundError:
+            return 0
+
+    def page(self, page=0, per_page=50):
+        """Returns one page of messages, newest first."""
+        total = self.count()
+        end = total - page * per_page
+        start = max(0, end - per_page)
+        if end <= 0:
+            return []
+        with open(self.index_path, 'rb') as index:
+            index.seek(start * OFFSET.size)
+            raw = index.read((end - start) * OFFSET.size)
+        first = OFFSET.unpack_from(raw, 0)[0]
+        with open(self.path, 'rb') as data:
+            data.seek(first)
+            lines = [data.readline() for _ in range(end - start)]
+        return [json.loads(line) for line in reversed(lines) if line.endswith(b'\n')]
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'messages': self.count(),
+            'written': self.written,
+            'batches': self.batches,
+            'fsyncs': self.fsyncs,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'queued': self._queue.qsize() if self._queue is not None else 0,
+        }
@@ -0,0 +1,67 @@
+import json
+import base64
+import heapq
+import bisect
+import binascii
+
+
+def listing_key(car):
+    """Sort key for listings: upload time, with the id as a tie-breaker."""
+    return (car.get('created_at') or 0, str(car['id']))
+
+
+def encode_cursor(key):
+    if key is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token):
+    """Returns the listing key in a cursor token, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        created_at, car_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return (float(created_at), str(car_id))
+    except (ValueError, TypeError, binascii.Error):
+        return None
+
+
+class NewestFirst:
+    """Keyset pagination over the catalog, newest listing first.
+
+    The sorted order of the whole catalog is kept per store generation, so
+    each unfiltered page costs a binary search and a slice however many cars
+    there are. Search results are paged on their own without touching it. A
+    cursor is the key of the last car on the previous page, so pages stay
+    stable while cars are added or deleted.
+    """
+
+    def __init__(self):
+        self._catalog = (None, [], [])
+
+    def _ordered(self, cars, generation):
+        cached_generation, ordered, keys = self._catalog
+        if cached_generation is None or cached_generation != generation:
+            ordered = sorted(cars, key=listing_key)
+            keys = [listing_key(car) for car in ordered]
+            self._catalog = (generation, ordered, keys)
+        return ordered, keys
+
+    def page(self, cars, cursor=None, page_size=24, generation=None):
+        """Returns the cars after cursor and the cursor for the following page (or None).
+
+        Pass the store generation when cars is the whole catalog, to reuse its
+        sorted order; without it cars is taken as a search result.
+        """
+        if generation is None:
+            if cursor is not None:
+                cars = [car for car in cars if listing_key(car) < cursor]
+            newest = heapq.nlargest(page_size + 1, cars, key=listing_key)
+            next_cursor = listing_key(newest[page_size - 1]) if len(newest) > page_size else None
+            return newest[:page_size], next_cursor
+        ordered, keys = self._ordered(cars, generation)
+        end = len(ordered) if cursor is None else bisect.bisect_left(keys, cursor)
+        start = max(0, end - page_size)
+        next_cursor = keys[start] if start > 0 else None
+        return ordered[start:end][::-1], next_cursor
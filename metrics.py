@@ -0,0 +1,104 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g, request, has_app_context
+
+# Upper bounds in seconds, as in the Prometheus client libraries
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Latency histogram with one series per label tuple."""
+
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(self.series.items()):
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            prefix = label_text + ',' if label_text else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """Request and span timings, served in the Prometheus text format at /metrics.
+
+    Every request is timed by endpoint, method and status. Code inside a
+    request can time a step with ``with span('render'):``. Each worker
+    process keeps its own numbers, so scrape every worker. Recording costs
+    one lock and a bisect per observation.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self.requests = Histogram('http_request_duration_seconds', 'Time spent handling requests.',
+                                  ('endpoint', 'method', 'status'))
+        self.spans = Histogram('app_span_duration_seconds', 'Time spent in instrumented steps of a request.',
+                               ('span',))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['metrics'] = self
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', self.expose)
+
+    def _start(self):
+        g.request_started = time.perf_counter()
+
+    def _finish(self, response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            labels = (request.endpoint or 'unmatched', request.method, str(response.status_code))
+            self.observe(self.requests, labels, time.perf_counter() - started)
+        return response
+
+    def observe(self, histogram, labels, value):
+        with self._lock:
+            histogram.observe(labels, value)
+
+    def expose(self):
+        with self._lock:
+            lines = self.requests.render() + self.spans.render()
+        startup = current_app.config.get('STARTUP_TIMES', {})
+        if startup:
+            lines.append('# HELP app_startup_seconds Time taken by each start-up phase.')
+            lines.append('# TYPE app_startup_seconds gauge')
+            for phase, seconds in sorted(startup.items()):
+                lines.append(f'app_startup_seconds{{phase="{phase}"}} {seconds}')
+        return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@contextmanager
+def span(name):
+    """Times the enclosed block under name, when the app has Metrics set up."""
+    metrics = current_app.extensions.get('metrics') if has_app_context() else None
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics is not None:
+            metrics.observe(metrics.spans, (name,), time.perf_counter() - started)
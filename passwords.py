@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+
+# bcrypt only looks at the first 72 bytes; older bcrypt releases truncated
+# silently and the hashes in users.json were made that way
+MAX_PASSWORD_BYTES = 72
+
+
+def _encode(password):
+    return password.encode('utf-8')[:MAX_PASSWORD_BYTES]
+
+
+# bcrypt and the process pool are imported on first use, keeping them out of
+# application start-up
+def _hash(password, rounds):
+    import bcrypt
+    started = time.thread_time()
+    hashed = bcrypt.hashpw(_encode(password), bcrypt.gensalt(rounds)).decode('utf-8')
+    return hashed, time.thread_time() - started
+
+
+def _check(hashed, password):
+    import bcrypt
+    started = time.thread_time()
+    try:
+        ok = bcrypt.checkpw(_encode(password), hashed.encode('utf-8'))
+    except ValueError:
+        ok = False
+    return ok, time.thread_time() - started
+
+
+def hash_rounds(hashed):
+    """The cost factor stored in a bcrypt hash such as '$2b$12$...', or None."""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """bcrypt hashing and checking in a bounded pool of worker processes.
+
+    A login burst then occupies at most PASSWORD_HASH_WORKERS processes, and
+    the request threads wait without holding the GIL, so page requests keep
+    being served. The cost comes from BCRYPT_LOG_ROUNDS. Set
+    PASSWORD_HASH_WORKERS to 0 to hash on the calling thread instead.
+    """
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.workers = 2
+        self._pool = None
+        self._lock = threading.Lock()
+        self.timings = {name: {'count': 0, 'seconds': 0.0, 'cpu_seconds': 0.0, 'max_seconds': 0.0}
+                        for name in ('hash', 'check')}
+        self.rehashes = 0
+        self.pool_restarts = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', min(2, os.cpu_count() or 1))
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        app.extensions['passwords'] = self
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # Forking this multithreaded server could copy a lock another
+                # thread holds (the import lock, say) and deadlock the child
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    # Each hashing process then starts with bcrypt already imported
+                    context.set_forkserver_preload(['passwords', 'bcrypt'])
+                else:
+                    context = multiprocessing.get_context('spawn')
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            return self._pool
+
+    def _submit(self, func, *args):
+        from concurrent.futures.process import BrokenProcessPool
+        for attempt in range(2):
+            pool = self._get_pool()
+            try:
+                return pool.submit(func, *args).result()
+            except BrokenProcessPool:
+                # A worker died (killed for memory, say); start a fresh pool
+                # instead of failing every later call
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                        self.pool_restarts += 1
+                pool.shutdown(wait=False)
+                if attempt:
+                    raise
+
+    def _run(self, name, func, *args):
+        started = time.perf_counter()
+        if self.workers:
+            result, cpu_seconds = self._submit(func, *args)
+        else:
+            result, cpu_seconds = func(*args)
+        elapsed = time.perf_counter() - started
+        timing = self.timings[name]
+        with self._lock:
+            timing['count'] += 1
+            timing['seconds'] += elapsed
+            timing['cpu_seconds'] += cpu_seconds
+            timing['max_seconds'] = max(timing['max_seconds'], elapsed)
+        return result
+
+    def hash(self, password):
+        return self._run('hash', _hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        return self._run('check', _check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    def upgraded_hash(self, hashed, password):
+        """After a successful check, returns a new hash at the configured cost if
+        hashed used a different one, otherwise None."""
+        if not self.needs_rehash(hashed):
+            return None
+        self.rehashes += 1
+        return self.hash(password)
+
+    def stats(self):
+        with self._lock:
+            timings = {name: dict(timing) for name, timing in self.timings.items()}
+        return {'rounds': self.rounds, 'workers': self.workers,
+                'rehashes': self.rehashes, 'pool_restarts': self.pool_restarts, **timings}
@@ -0,0 +1,216 @@
+import os
+import uuid
+import hashlib
+
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from images import make_variants
+from upload_gc import photo_basename
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of each accepted image format and the extension it is stored with
+IMAGE_SIGNATURES = [
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+SNIFF_SIZE = 8
+
+
+def sniff_image_type(head):
+    """Returns the extension for an image's leading bytes, or None if it is not one we accept."""
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    return None
+
+
+class UploadSpool:
+    """Holds one uploaded file part, written straight into the upload folder.
+
+    Werkzeug writes multipart data into this object instead of its own
+    temporary file. The data is hashed and size-checked as it arrives, and a
+    part whose first bytes are not a known image stops being written at once.
+    PhotoStore.save() then renames the part file into place, so the photo is
+    never copied. If nothing claims the file, it is deleted when the request
+    closes it.
+    """
+
+    def __init__(self, folder, max_size):
+        self.path = os.path.join(folder, f'.{uuid.uuid4()}.part')
+        self.max_size = max_size
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+        self.image_type = None
+        self.claimed = False
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.close()
+            raise RequestEntityTooLarge()
+        if len(self.head) < SNIFF_SIZE:
+            self.head += data[:SNIFF_SIZE - len(self.head)]
+            if len(self.head) >= SNIFF_SIZE:
+                self.image_type = sniff_image_type(self.head)
+        elif self.image_type is None:
+            return len(data)  # not an image: drop the rest
+        self.digest.update(data)
+        return self._file.write(data)
+
+    def claim(self):
+        """Hands the finished part file over to the caller and returns its path."""
+        self._file.close()
+        self.claimed = True
+        return self.path
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.claimed:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """Request class that spools file uploads into UPLOAD_FOLDER via UploadSpool."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadSpool(current_app.config['UPLOAD_FOLDER'], current_app.config['MAX_PHOTO_SIZE'])
+
+
+def image_type(file):
+    """Returns the extension to store an uploaded file under, or None if it is not an image."""
+    stream = file.stream
+    if isinstance(stream, UploadSpool):
+        return stream.image_type if len(stream.head) >= SNIFF_SIZE else None
+    head = stream.read(SNIFF_SIZE)
+    stream.seek(0)
+    return sniff_image_type(head)
+
+
+class PhotoStore:
+    """Uploaded photos stored once per distinct content, named by SHA-256.
+
+    ``refs_store`` maps each digest to {'file', 'refs', 'variants'}. Saving the
+    same picture again only bumps its reference count. release_many() deletes
+    the file and its variants once the last car using it is gone.
+    """
+
+    def __init__(self, folder, refs_store):
+        self.folder = folder
+        self.refs_store = refs_store
+
+    def _path(self, filename):
+        return os.path.join(self.folder, filename)
+
+    def _unlink(self, filename):
+        try:
+            os.remove(self._path(filename))
+        except FileNotFoundError:
+            pass
+
+    def save(self, file, ext, reference=True):
+        """Stores an uploaded file and returns its filename and variants.
+
+        With reference=False the photo is stored without counting a use of
+        it; a car claims it later with acquire(). Until then it is only
+        kept for the upload garbage collector's grace period.
+        """
+        if isinstance(file.stream, UploadSpool):
+            key = file.stream.digest.hexdigest()
+            tmp_path = file.stream.claim()
+        else:
+            digest = hashlib.sha256()
+            tmp_path = self._path(f'.{uuid.uuid4()}.part')
+            with open(tmp_path, 'wb') as out:
+                for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+            key = digest.hexdigest()
+
+        filename = f'{key}.{ext}'
+        variants = None
+        while True:
+            # The lock covers only the reference count, never the image encoding
+            with self.refs_store.locked():
+                record = self.refs_store.get(key)
+                if record is not None and os.path.exists(self._path(record['file'])):
+                    os.remove(tmp_path)
+                    # Restarts the upload garbage collector's grace period for this photo
+                    os.utime(self._path(record['file']))
+                    record = dict(record, refs=record['refs'] + int(reference))
+                    self.refs_store.put(key, record)
+                    return record['file'], record['variants']
+                # A release_many() of an earlier copy may have deleted variants made outside the lock
+                if variants is not None and all(os.path.exists(self._path(variant['file']))
+                                                for variant in variants.values()):
+                    os.replace(tmp_path, self._path(filename))
+                    record = {'file': filename, 'refs': int(reference), 'variants': variants}
+                    self.refs_store.put(key, record)
+                    return record['file'], record['variants']
+            # Variants are named by digest, so a concurrent upload of the same
+            # picture just writes identical files
+            variants = make_variants(tmp_path, key)
+
+    def acquire(self, filename):
+        """Counts one more use of a stored photo; returns its filename and variants, or None if it is gone."""
+        key = photo_basename(filename).split('.', 1)[0]
+        with self.refs_store.locked():
+            record = self.refs_store.get(key)
+            if record is None or record['file'] != filename or not os.path.exists(self._path(filename)):
+                return None
+            os.utime(self._path(filename))
+            self.refs_store.put(key, dict(record, refs=record['refs'] + 1))
+        return record['file'], record['variants']
+
+    def release_many(self, photos):
+        """Drops one reference per (filename, variants) pair, with one refs_store write.
+
+        A photo's file and variants are deleted with its last reference. Files
+        saved before photos were content-addressed have no reference record
+        and are deleted straight away, along with the variants given. Returns
+        how many photos had their files deleted.
+        """
+        deleted = 0
+        with self.refs_store.locked():
+            records = {}
+            for filename, variants in photos:
+                # Listings from the first version store 'static/uploads/<name>'
+                name = photo_basename(filename)
+                key = name.split('.', 1)[0]
+                record = records[key] if key in records else self.refs_store.get(key)
+                if record is None:
+                    self._unlink(name)
+                    for variant in (variants or {}).values():
+                        self._unlink(photo_basename(variant['file']))
+                    deleted += 1
+                    continue
+                records[key] = dict(record, refs=record['refs'] - 1)
+            gone = [key for key, record in records.items() if record['refs'] <= 0]
+            self.refs_store.put_many((key, record) for key, record in records.items() if record['refs'] > 0)
+            self.refs_store.delete_many(gone)
+            # Still under the lock, so a save() of the same picture cannot slip in between
+            for key in gone:
+                self._unlink(records[key]['file'])
+                for variant in records[key]['variants'].values():
+                    self._unlink(variant['file'])
+            deleted += len(gone)
+        return deleted
+
+    def stats(self):
+        records = self.refs_store.load()
+        return {
+            'photos': len(records),
+            'references': sum(record['refs'] for record in records.values()),
+        }
@@ -0,0 +1,86 @@
+import os
+import hmac
+import time
+import cProfile
+import threading
+import tracemalloc
+
+from flask import g, request
+
+PROFILE_HEADER = 'X-Profile'
+MEMORY_HEADER = 'X-Profile-Memory'
+
+
+class RequestProfiler:
+    """Profiles single requests on demand, for diagnosing slow pages in production.
+
+    With PROFILER_ENABLED set and a PROFILER_SECRET configured, a request
+    sent with ``X-Profile: <secret>`` runs under cProfile, and the stats are
+    written to PROFILER_DIR as ``<endpoint>-<timestamp>-<pid>.prof`` (open them with
+    pstats or snakeviz). Adding ``X-Profile-Memory: 1`` also traces
+    allocations with tracemalloc and writes the top allocation sites next to
+    the profile. Only one request is profiled at a time; a second
+    one arriving meanwhile just runs normally.
+    """
+
+    def __init__(self, app=None):
+        self._busy = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_DIR', 'profiles')
+        self.secret = app.config.get('PROFILER_SECRET') or ''
+        self.folder = app.config['PROFILER_DIR']
+        app.extensions['profiler'] = self
+        if self.secret:
+            app.before_request(self._start)
+            app.after_request(self._tag_response)
+            app.teardown_request(self._finish)
+
+    def _requested(self):
+        token = request.headers.get(PROFILE_HEADER)
+        return token is not None and hmac.compare_digest(token.encode('utf-8'), self.secret.encode('utf-8'))
+
+    def _start(self):
+        if not self._requested() or not self._busy.acquire(blocking=False):
+            return
+        now = time.time()
+        g.profile_name = (f'{request.endpoint or "unmatched"}-{time.strftime("%Y%m%d-%H%M%S", time.localtime(now))}'
+                          f'.{int(now * 1000) % 1000:03d}-{os.getpid()}')
+        # Leave tracemalloc alone if something else already started it
+        g.profile_memory = request.headers.get(MEMORY_HEADER) == '1' and not tracemalloc.is_tracing()
+        if g.profile_memory:
+            tracemalloc.start(25)
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+    def _tag_response(self, response):
+        if 'profile_name' in g:
+            response.headers['X-Profile-File'] = g.profile_name + '.prof'
+        return response
+
+    def _finish(self, error=None):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return
+        try:
+            profiler.disable()
+            os.makedirs(self.folder, exist_ok=True)
+            path = os.path.join(self.folder, g.profile_name)
+            profiler.dump_stats(path + '.prof')
+            if g.profile_memory:
+                # The profiler's own bookkeeping is not what we are looking for
+                snapshot = tracemalloc.take_snapshot().filter_traces([
+                    tracemalloc.Filter(False, cProfile.__file__),
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                ])
+                traced, peak = tracemalloc.get_traced_memory()
+                with open(path + '-memory.txt', 'w') as f:
+                    f.write(f'traced: {traced} bytes, peak: {peak} bytes\n\n')
+                    for stat in snapshot.statistics('lineno')[:50]:
+                        f.write(f'{stat}\n')
+        finally:
+            if g.profile_memory:
+                tracemalloc.stop()
+            self._busy.release()
@@ -0,0 +1,192 @@
+import re
+import bisect
+import threading
+
+from storage import numeric_price, numeric_year
+
+TEXT_FIELDS = ('make', 'model', 'details')
+
+
+def tokenize(text):
+    return re.findall(r'\w+', str(text).lower())
+
+
+class RangeIndex:
+    """Car ids sorted by a numeric value, for range queries by binary search."""
+
+    def __init__(self):
+        self.values = []
+        self.ids = []
+
+    def build(self, pairs):
+        pairs = sorted(pairs)
+        self.values = [value for value, _ in pairs]
+        self.ids = [car_id for _, car_id in pairs]
+
+    def add(self, value, car_id):
+        i = bisect.bisect_right(self.values, value)
+        self.values.insert(i, value)
+        self.ids.insert(i, car_id)
+
+    def remove(self, value, car_id):
+        i = bisect.bisect_left(self.values, value)
+        while i < len(self.values) and self.values[i] == value:
+            if self.ids[i] == car_id:
+                del self.values[i]
+                del self.ids[i]
+                return
+            i += 1
+
+    def between(self, low=None, high=None):
+        start = 0 if low is None else bisect.bisect_left(self.values, low)
+        end = len(self.values) if high is None else bisect.bisect_right(self.values, high)
+        return self.ids[start:end]
+
+
+class CatalogIndex:
+    """Inverted word index over make/model/details plus year and price range indexes.
+
+    upload and delete keep the index current through add() and remove(). They
+    pass the store generation from before and after their write. If anything
+    else changed the store in between, for example another worker, the index
+    is marked stale and rebuilt from the store on the next search.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._reset()
+
+    def _reset(self):
+        self.cars = {}
+        self.postings = {}
+        self.vocabulary = []
+        self.years = RangeIndex()
+        self.prices = RangeIndex()
+
+    @staticmethod
+    def _tokens(car):
+        return {token for field in TEXT_FIELDS for token in tokenize(car.get(field, ''))}
+
+    def _index(self, car):
+        car_id = str(car['id'])
+        if car_id in self.cars:
+            self._unindex(car_id)
+        self.cars[car_id] = car
+        for token in self._tokens(car):
+            if token not in self.postings:
+                self.postings[token] = set()
+                bisect.insort(self.vocabulary, token)
+            self.postings[token].add(car_id)
+        year = numeric_year(car.get('year'))
+        if year is not None:
+            self.years.add(year, car_id)
+        price = numeric_price(car.get('price'))
+        if price is not None:
+            self.prices.add(price, car_id)
+
+    def _unindex(self, car_id):
+        car = self.cars.pop(car_id, None)
+        if car is None:
+            return
+        for token in self._tokens(car):
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            ids.discard(car_id)
+            if not ids:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+        year = numeric_year(car.get('year'))
+        if year is not None:
+            self.years.remove(year, car_id)
+        price = numeric_price(car.get('price'))
+        if price is not None:
+            self.prices.remove(price, car_id)
+
+    def rebuild(self, cars, generation=None):
+        with self._lock:
+            self._reset()
+            years, prices = [], []
+            for car in cars:
+                car_id = str(car['id'])
+                self.cars[car_id] = car
+                for token in self._tokens(car):
+                    self.postings.setdefault(token, set()).add(car_id)
+                year = numeric_year(car.get('year'))
+                if year is not None:
+                    years.append((year, car_id))
+                price = numeric_price(car.get('price'))
+                if price is not None:
+                    prices.append((price, car_id))
+            self.vocabulary = sorted(self.postings)
+            self.years.build(years)
+            self.prices.build(prices)
+            self._generation = generation
+
+    def _apply(self, before, after, change):
+        with self._lock:
+            if self._generation is None or self._generation != before or after > before + 1:
+                self._generation = None
+            elif after == before + 1:
+                change()
+                self._generation = after
+
+    def add(self, car, before, after):
+        """Indexes a car just written to the store between generations before and after."""
+        self._apply(before, after, lambda: self._index(car))
+
+    def remove(self, car_id, before, after):
+        """Drops a car just deleted from the store between generations before and after."""
+        self._apply(before, after, lambda: self._unindex(car_id))
+
+    def add_many(self, cars, before, after):
+        """Indexes cars written to the store in one change between generations before and after."""
+        self._apply(before, after, lambda: [self._index(car) for car in cars])
+
+    def remove_many(self, car_ids, before, after):
+        """Drops cars deleted from the store in one change between generations before and after."""
+        self._apply(before, after, lambda: [self._unindex(car_id) for car_id in car_ids])
+
+    def sync(self, store):
+        """Rebuilds the index if the store has changed since it was last indexed."""
+        cars = store.load()
+        generation = store.generation
+        if generation != self._generation:
+            self.rebuild(cars, generation)
+
+    def _matching_words(self, token):
+        """Ids of cars with a word starting with token."""
+        ids = set()
+        i = bisect.bisect_left(self.vocabulary, token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(token):
+            ids |= self.postings[self.vocabulary[i]]
+            i += 1
+        return ids
+
+    def search(self, text=None, year_min=None, year_max=None, price_min=None, price_max=None):
+        """Returns the cars matching every word of text and every given range."""
+        with self._lock:
+            candidates = []
+            for token in tokenize(text or ''):
+                candidates.append(self._matching_words(token))
+            if year_min is not None or year_max is not None:
+                candidates.append(set(self.years.between(year_min, year_max)))
+            if price_min is not None or price_max is not None:
+                candidates.append(set(self.prices.between(price_min, price_max)))
+            if not candidates:
+                return list(self.cars.values())
+            candidates.sort(key=len)
+            ids = candidates[0].intersection(*candidates[1:])
+            return [self.cars[car_id] for car_id in ids]
+
+
+def search_filters(args):
+    """Reads q, year_min/year_max and price_min/price_max from query string args."""
+    return {
+        'text': args.get('q', '').strip() or None,
+        'year_min': numeric_year(args.get('year_min')),
+        'year_max': numeric_year(args.get('year_max')),
+        'price_min': numeric_price(args.get('price_min')),
+        'price_max': numeric_price(args.get('price_max')),
+    }
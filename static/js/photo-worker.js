@@ -0,0 +1,30 @@
+// Crops, downscales and re-encodes one photo off the main thread.
+// Message in:  {id, file, crop: {x, y, width, height}, maxEdge, quality}
+// Message out: {id, blob, width, height} or {id, error}
+self.onmessage = async (event) => {
+    const { id, file, crop, maxEdge, quality } = event.data;
+    let bitmap;
+    try {
+        bitmap = await createImageBitmap(file);
+        const x = Math.max(0, Math.round(crop.x));
+        const y = Math.max(0, Math.round(crop.y));
+        const sourceWidth = Math.min(bitmap.width - x, Math.round(crop.width));
+        const sourceHeight = Math.min(bitmap.height - y, Math.round(crop.height));
+        const scale = Math.min(1, maxEdge / Math.max(sourceWidth, sourceHeight));
+        const width = Math.max(1, Math.round(sourceWidth * scale));
+        const height = Math.max(1, Math.round(sourceHeight * scale));
+
+        const canvas = new OffscreenCanvas(width, height);
+        const context = canvas.getContext('2d');
+        context.imageSmoothingQuality = 'high';
+        context.drawImage(bitmap, x, y, sourceWidth, sourceHeight, 0, 0, width, height);
+        const blob = await canvas.convertToBlob({ type: 'image/jpeg', quality });
+        self.postMessage({ id, blob, width, height });
+    } catch (error) {
+        self.postMessage({ id, error: String(error) });
+    } finally {
+        if (bitmap) {
+            bitmap.close();
+        }
+    }
+};
@@ -0,0 +1,425 @@
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:  # no cross-process locking on Windows
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# Whether file_lock() excludes other processes
+FILE_LOCKING = fcntl is not None
+
+def numeric_price(price):
+    """Returns the number in a price such as '₹5,00,000', or None."""
+    digits = ''.join(ch for ch in str(price) if ch.isdigit() or ch == '.')
+    try:
+        return float(digits)
+    except ValueError:
+        return None
+
+
+def numeric_year(year):
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        return None
+
+
+def _file_signature(st):
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def write_atomic(path, data, **dump_args):
+    """Writes data as JSON to a temporary file, fsyncs it and renames it over path."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, **dump_args)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+@contextmanager
+def file_lock(f, blocking=True, length=None, offset=0):
+    """Holds an exclusive lock on an open file (or descriptor) against other processes.
+
+    With length, only that many bytes from offset are locked (an fcntl record
+    lock) instead of the whole file. With blocking=False it yields False,
+    holding nothing, if another process has the lock. Without fcntl (Windows)
+    it locks nothing and yields True.
+    """
+    if fcntl is None:
+        yield True
+        return
+    flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+    try:
+        if length is None:
+            fcntl.flock(f, flags)
+        else:
+            fcntl.lockf(f, flags, length, offset)
+        locked = True
+    except (BlockingIOError, PermissionError):
+        if blocking:
+            raise
+        locked = False
+    if not locked:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        if length is None:
+            fcntl.flock(f, fcntl.LOCK_UN)
+        else:
+            fcntl.lockf(f, fcntl.LOCK_UN, length, offset)
+
+
+class JournaledStore:
+    """Keyed records persisted as a JSON snapshot plus an append-only journal.
+
+    The snapshot keeps the original file format (a list of records or a dict),
+    so existing data files load unchanged. Every change appends one small
+    put/delete line to ``<path>.log`` instead of rewriting the snapshot; once
+    the journal holds ``compact_threshold`` records it is folded into a new
+    snapshot, which is swapped in with an atomic rename. Replaying a journal
+    record twice has no effect, so a crash between the rename and the journal
+    truncation loses nothing.
+
+    The parsed data is cached in memory. Reads only stat the files: if the
+    journal has grown, just its tail is read; if the snapshot was replaced,
+    everything is reloaded. The value returned by load() is shared between
+    requests and must be treated as read-only.
+
+    Records are keyed by ``key_field`` for a list of records, or by the dict
+    key when ``as_dict`` is set. The in-memory records form a hash index on
+    that key, so get(), put() and delete() cost the same at any size. Keys
+    are compared as strings, so ids that older versions stored as numbers
+    are still found from URL parameters.
+
+    Writers in different processes are serialised by an flock on
+    ``<path>.lock``. Each writer catches up with the journal under the lock
+    before changing anything, so no update is lost. Journal lines are fsynced
+    by group commit: one thread syncs on behalf of every line written so far,
+    and the other writers waiting at the same time return once that sync is
+    done.
+    """
+
+    def __init__(self, path, key_field=None, as_dict=False, compact_threshold=1000):
+        self.path = path
+        self.journal_path = path + '.log'
+        self.key_field = key_field
+        self.as_dict = as_dict
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
+        self._journal = None
+        self._sync_condition = threading.Condition()
+        self._syncing = False
+        self._written = 0
+        self._synced = 0
+        self._records = None
+        self._view = None
+        self._snapshot_signature = None
+        self._offset = 0
+        self._journal_records = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.tail_reads = 0
+        self.compactions = 0
+        self.fsyncs = 0
+        self.corrupt_lines = 0
+
+    # Reading
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, 'r') as f:
+                signature = _file_signature(os.fstat(f.fileno()))
+                try:
+                    data = json.load(f)
+                except json.JSONDecodeError:
+                    data = {} if self.as_dict else []
+        except FileNotFoundError:
+            return {}, None
+        return self._records_from(data), signature
+
+    def _records_from(self, data):
+        if self.as_dict:
+            return dict(data)
+        return {str(record[self.key_field]): record for record in data}
+
+    def _key(self, key):
+        return str(key)
+
+    def _replay(self, offset):
+        """Applies complete journal lines from offset onwards."""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        end = chunk.rfind(b'\n') + 1  # ignore a line that is still being written
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Left by a crash mid-append before torn tails were cut off; the write never completed
+                self.corrupt_lines += 1
+                log.warning('Skipping unreadable journal line in %s: %r', self.journal_path, line[:200])
+                continue
+            self._apply(entry)
+        self._offset = offset + end
+
+    def _apply(self, entry):
+        if entry['op'] == 'batch':
+            for item in entry['entries']:
+                self._apply(item)
+            return
+        if entry['op'] == 'put':
+            self._records[self._key(entry['key'])] = entry['value']
+        elif entry['op'] == 'del':
+            self._records.pop(self._key(entry['key']), None)
+        self._journal_records += 1
+
+    def _journal_size(self):
+        try:
+            return os.stat(self.journal_path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def _refresh(self):
+        try:
+            snapshot_signature = _file_signature(os.stat(self.path))
+        except FileNotFoundError:
+            snapshot_signature = None
+        journal_size = self._journal_size()
+        if self._records is not None and snapshot_signature == self._snapshot_signature:
+            if journal_size == self._offset:
+                self.hits += 1
+                return
+            if journal_size > self._offset:
+                self.tail_reads += 1
+                self._replay(self._offset)
+                self._changed()
+                return
+        self.misses += 1
+        self._records, self._snapshot_signature = self._read_snapshot()
+        self._offset = 0
+        self._journal_records = 0
+        self._replay(0)
+        self._changed()
+
+    def _changed(self):
+        self._view = None
+        self.generation += 1
+
+    def load(self):
+        """Returns all records as a list (or a dict when as_dict is set)."""
+        with self._lock:
+            self._refresh()
+            if self._view is None:
+                if self.as_dict:
+                    self._view = dict(self._records)
+                else:
+                    self._view = list(self._records.values())
+            return self._view
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._refresh()
+            return self._records.get(self._key(key), default)
+
+    def _file_stats(self):
+        stats = []
+        for path in (self.path, self.journal_path):
+            try:
+                stats.append(os.stat(path))
+            except FileNotFoundError:
+                stats.append(None)
+        return stats
+
+    @property
+    def version(self):
+        """A token that changes with the files on disk and is the same in every process."""
+        return '.'.join('%x-%x-%x' % _file_signature(st) if st else '0' for st in self._file_stats())
+
+    @property
+    def last_modified(self):
+        """Time of the last write to the snapshot or journal, or None if neither exists."""
+        return max((st.st_mtime for st in self._file_stats() if st), default=None)
+
+    # Writing
+
+    @contextmanager
+    def locked(self):
+        """Holds the store against writers in this and other processes.
+
+        Use it around a read-modify-write such as get() followed by put().
+        """
+        with self._lock:
+            if self._lock_depth:
+                lock = nullcontext()
+            else:
+                if self._lock_file is None:
+                    self._lock_file = open(self.path + '.lock', 'a')
+                lock = file_lock(self._lock_file)
+            with lock:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+
+    def _cut_torn_tail(self):
+        """Drops a partial last journal line left by a writer that crashed mid-append.
+
+        Called under the lock right after _refresh(), which has replayed every
+        complete line, so anything past self._offset is such a fragment.
+        Without this the next line would be glued onto it.
+        """
+        if self._journal_size() > self._offset:
+            os.truncate(self.journal_path, self._offset)
+
+    def _append_journal(self, entry):
+        """Writes one journal line (without fsync) and returns its commit ticket."""
+        line = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+        self._cut_torn_tail()
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab', buffering=0)
+        self._journal.write(line)
+        size = os.fstat(self._journal.fileno()).st_size
+        # Skip re-reading our own line unless another writer got in between
+        if size == self._offset + len(line):
+            self._offset = size
+        self._written += 1
+        return self._written
+
+    def _wait_durable(self, ticket):
+        """Returns once the journal line with this ticket has been fsynced."""
+        with self._sync_condition:
+            while self._synced < ticket:
+                if self._syncing:
+                    self._sync_condition.wait()
+                    continue
+                self._syncing = True
+                target = self._written
+                self._sync_condition.release()
+                try:
+                    os.fsync(self._journal.fileno())
+                finally:
+                    self._sync_condition.acquire()
+                    self._syncing = False
+                    self._sync_condition.notify_all()
+                self._synced = max(self._synced, target)
+                self.fsyncs += 1
+
+    def _write(self, entry):
+        with self.locked():
+            self._refresh()
+            self._apply(entry)
+            ticket = self._append_journal(entry)
+            self._changed()
+            if self._journal_records >= self.compact_threshold:
+                self.compact()
+        self._wait_durable(ticket)
+
+    def put(self, key, value):
+        """Adds or replaces the record stored under key."""
+        self._write({'op': 'put', 'key': self._key(key), 'value': value})
+
+    def delete(self, key):
+        """Removes the record stored under key and returns it, or None."""
+        with self.locked():
+            self._refresh()
+            key = self._key(key)
+            record = self._records.get(key)
+            if record is not None:
+                self._write({'op': 'del', 'key': key})
+            return record
+
+    def put_many(self, items):
+        """Adds or replaces every (key, value) in items as one journal line.
+
+        Readers and a crash recovery see either all of them or none.
+        """
+        entries = [{'op': 'put', 'key': self._key(key), 'value': value} for key, value in items]
+        if entries:
+            self._write({'op': 'batch', 'entries': entries})
+
+    def delete_many(self, keys):
+        """Removes the records under keys as one journal line; returns the removed records."""
+        with self.locked():
+            self._refresh()
+            removed = {}
+            for key in map(self._key, keys):
+                if key in self._records and key not in removed:
+                    removed[key] = self._records[key]
+            if removed:
+                self._write({'op': 'batch', 'entries': [{'op': 'del', 'key': key} for key in removed]})
+            return list(removed.values())
+
+    def iterate(self):
+        """Yields the records one by one, from the cached list."""
+        return iter(self.load())
+
+    def _write_snapshot(self, records):
+        if self.as_dict:
+            data = records
+        else:
+            data = list(records.values())
+        write_atomic(self.path, data, indent=4)
+        if os.path.exists(self.journal_path):
+            os.truncate(self.journal_path, 0)
+        self._snapshot_signature = _file_signature(os.stat(self.path))
+        self._offset = 0
+        self._journal_records = 0
+        # Everything written so far is in the fsynced snapshot now
+        with self._sync_condition:
+            self._synced = self._written
+
+    def compact(self):
+        """Folds the journal into a new snapshot."""
+        with self.locked():
+            self._refresh()
+            self._write_snapshot(self._records)
+            self.compactions += 1
+
+    def save(self, data):
+        """Replaces the whole store with data (a list, or a dict when as_dict is set)."""
+        with self.locked():
+            self._records = self._records_from(data)
+            self._write_snapshot(self._records)
+            self._changed()
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'hits': self.hits,
+            'misses': self.misses,
+            'tail_reads': self.tail_reads,
+            'journal_records': self._journal_records,
+            'compactions': self.compactions,
+            'fsyncs': self.fsyncs,
+            'corrupt_lines': self.corrupt_lines,
+            'generation': self.generation,
+        }
@@ -0,0 +1,250 @@
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from storage import numeric_price, numeric_year
+
+
+class SqliteStore:
+    """A table in a SQLite database with the same interface as JournaledStore.
+
+    Each record is kept as JSON in the ``data`` column. Fields that queries
+    filter or sort on are copied into their own indexed columns. Triggers bump
+    a per-table counter in ``store_versions`` on every change. load() compares
+    that counter, which is a single-row lookup, and reuses its cached list
+    until another connection or process writes. ``version`` adds an id made
+    when the database was created, since a new database starts counting at 0
+    again.
+    """
+
+    def __init__(self, database, table, key_field=None, as_dict=False, columns=None, indexes=()):
+        self.database = database
+        self.table = table
+        self.key_field = key_field
+        self.as_dict = as_dict
+        self.columns = columns or {}
+        self.indexes = indexes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._view = None
+        self._view_version = None
+        self.hits = 0
+        self.misses = 0
+        self._create_schema()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.database, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def locked(self):
+        """Runs the enclosed reads and writes as one IMMEDIATE transaction."""
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+        finally:
+            self._local.depth = 0
+
+    def _create_schema(self):
+        columns = ['seq INTEGER PRIMARY KEY AUTOINCREMENT', 'key TEXT UNIQUE NOT NULL']
+        for name, (declaration, _) in self.columns.items():
+            columns.append(f'{name} {declaration}')
+        columns.append('data TEXT NOT NULL')
+
+        conn = self._connection()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS store_versions '
+                         '(name TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO store_versions VALUES (?, 0, ?)', (self.table, time.time()))
+            conn.execute('CREATE TABLE IF NOT EXISTS store_info (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO store_info VALUES ('database_id', ?)", (uuid.uuid4().hex,))
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {self.table} ({", ".join(columns)})')
+            for index_columns in self.indexes:
+                name = f'{self.table}_{"_".join(index_columns)}'
+                conn.execute(f'CREATE INDEX IF NOT EXISTS {name} '
+                             f'ON {self.table} ({", ".join(index_columns)})')
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(f'CREATE TRIGGER IF NOT EXISTS {self.table}_{event.lower()}_version '
+                             f'AFTER {event} ON {self.table} BEGIN '
+                             'UPDATE store_versions SET version = version + 1, '
+                             "updated_at = (julianday('now') - 2440587.5) * 86400.0 "
+                             f"WHERE name = '{self.table}'; "
+                             'END')
+
+    @property
+    def version(self):
+        """A token that changes with every write and is the same in every process."""
+        row = self._connection().execute(
+            "SELECT (SELECT value FROM store_info WHERE name = 'database_id'), version "
+            'FROM store_versions WHERE name = ?', (self.table,)).fetchone()
+        return f'{row[0]}.{row[1]}'
+
+    @property
+    def last_modified(self):
+        row = self._connection().execute(
+            'SELECT updated_at FROM store_versions WHERE name = ?', (self.table,)).fetchone()
+        return row[0]
+
+    @property
+    def generation(self):
+        row = self._connection().execute(
+            'SELECT version FROM store_versions WHERE name = ?', (self.table,)).fetchone()
+        return row[0]
+
+    def _row_values(self, value):
+        return [extract(value) for _, extract in self.columns.values()]
+
+    def _insert_sql(self):
+        names = list(self.columns) + ['key', 'data']
+        placeholders = ', '.join('?' for _ in names)
+        return f'INSERT INTO {self.table} ({", ".join(names)}) VALUES ({placeholders})'
+
+    # Reading
+
+    def load(self):
+        """Returns all records as a list (or a dict when as_dict is set)."""
+        version = self.version
+        with self._lock:
+            if self._view is not None and version == self._view_version:
+                self.hits += 1
+                return self._view
+            self.misses += 1
+            conn = self._connection()
+            if self.as_dict:
+                rows = conn.execute(f'SELECT key, data FROM {self.table} ORDER BY seq')
+                view = {key: json.loads(data) for key, data in rows}
+            else:
+                rows = conn.execute(f'SELECT data FROM {self.table} ORDER BY seq')
+                view = [json.loads(data) for (data,) in rows]
+            self._view = view
+            self._view_version = version
+            return view
+
+    def get(self, key, default=None):
+        row = self._connection().execute(
+            f'SELECT data FROM {self.table} WHERE key = ?', (self._key(key),)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _key(self, key):
+        return str(key)
+
+    # Writing
+
+    def put(self, key, value):
+        """Adds or replaces the record stored under key."""
+        assignments = ', '.join(f'{name} = excluded.{name}' for name in list(self.columns) + ['data'])
+        conn = self._connection()
+        with self.locked():
+            conn.execute(self._insert_sql() + f' ON CONFLICT(key) DO UPDATE SET {assignments}',
+                         self._row_values(value) + [self._key(key), json.dumps(value)])
+
+    def delete(self, key):
+        """Removes the record stored under key and returns it, or None."""
+        conn = self._connection()
+        with self.locked():
+            row = conn.execute(f'DELETE FROM {self.table} WHERE key = ? RETURNING data',
+                               (self._key(key),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_many(self, items):
+        """Adds or replaces every (key, value) in items in one transaction."""
+        assignments = ', '.join(f'{name} = excluded.{name}' for name in list(self.columns) + ['data'])
+        conn = self._connection()
+        with self.locked():
+            conn.executemany(self._insert_sql() + f' ON CONFLICT(key) DO UPDATE SET {assignments}',
+                             (self._row_values(value) + [self._key(key), json.dumps(value)]
+                              for key, value in items))
+
+    def delete_many(self, keys):
+        """Removes the records under keys in one transaction; returns the removed records."""
+        conn = self._connection()
+        removed = []
+        with self.locked():
+            for key in keys:
+                row = conn.execute(f'DELETE FROM {self.table} WHERE key = ? RETURNING data',
+                                   (self._key(key),)).fetchone()
+                if row:
+                    removed.append(json.loads(row[0]))
+        return removed
+
+    def iterate(self):
+        """Yields the records one by one straight from a cursor, without building the list."""
+        cursor = sqlite3.connect(self.database, timeout=30).execute(
+            f'SELECT data FROM {self.table} ORDER BY seq')
+        try:
+            for (data,) in cursor:
+                yield json.loads(data)
+        finally:
+            cursor.connection.close()
+
+    def save(self, data):
+        """Replaces the whole table with data (a list, or a dict when as_dict is set)."""
+        conn = self._connection()
+        with self.locked():
+            conn.execute(f'DELETE FROM {self.table}')
+            if self.as_dict:
+                items = data.items()
+            else:
+                items = ((record[self.key_field], record) for record in data)
+            conn.executemany(self._insert_sql(),
+                             (self._row_values(value) + [self._key(key), json.dumps(value)]
+                              for key, value in items))
+
+    def stats(self):
+        return {
+            'path': f'{self.database}:{self.table}',
+            'hits': self.hits,
+            'misses': self.misses,
+            'generation': self.generation,
+        }
+
+
+CAR_COLUMNS = {
+    'make': ('TEXT COLLATE NOCASE', lambda car: car.get('make')),
+    'model': ('TEXT COLLATE NOCASE', lambda car: car.get('model')),
+    'year': ('INTEGER', lambda car: numeric_year(car.get('year'))),
+    'price_value': ('REAL', lambda car: numeric_price(car.get('price'))),
+}
+CAR_INDEXES = [('make', 'model'), ('year',), ('price_value',)]
+
+
+def open_sqlite_stores(database):
+    """Returns the cars, users and photo reference stores backed by one database file."""
+    cars_store = SqliteStore(database, 'cars', key_field='id',
+                             columns=CAR_COLUMNS, indexes=CAR_INDEXES)
+    users_store = SqliteStore(database, 'users', as_dict=True)
+    photo_refs_store = SqliteStore(database, 'photos', as_dict=True)
+    return cars_store, users_store, photo_refs_store
+
+
+def migrate_json(json_stores, sqlite_stores):
+    """Copies every JSON store into the matching SQLite store; returns the row counts."""
+    counts = []
+    for source, target in zip(json_stores, sqlite_stores):
+        data = source.load()
+        target.save(data)
+        counts.append((target.table, len(data)))
+    return counts
@@ -0,0 +1,154 @@
+import os
+import time
+import logging
+import threading
+
+from storage import file_lock
+
+log = logging.getLogger(__name__)
+
+
+def photo_basename(path):
+    """The file name of a stored photo path.
+
+    The first version stored 'static/uploads/<name>' (with the OS separator),
+    later ones the bare file name.
+    """
+    return path.replace('\\', '/').rsplit('/', 1)[-1]
+
+
+def referenced_files(cars):
+    """Names of every upload a listing refers to, photos and their variants."""
+    names = set()
+    for car in cars:
+        for photo in car.get('photos') or []:
+            names.add(photo_basename(photo))
+        for variants in car.get('photo_variants') or []:
+            for variant in (variants or {}).values():
+                names.add(variant['file'])
+    return names
+
+
+class UploadCollector:
+    """Deletes files in the upload folder that no listing refers to.
+
+    A pass builds the set of referenced names from the catalog, then walks
+    the folder with os.scandir, so the listing is never held in memory. It
+    pauses for ``pause`` seconds after every ``batch_size`` entries, so it
+    can run alongside the server on a very large folder. Files younger than
+    ``grace_period`` seconds are kept; they may belong to an upload that has
+    not reached the catalog yet. For content-addressed photos, the
+    reference record in the photo store is removed together with the files.
+    Only one process collects at a time: a pass takes an flock on
+    ``.gc.lock`` in the folder and is skipped if another holds it.
+    """
+
+    def __init__(self, catalog, grace_period=3600, batch_size=500, pause=0.05):
+        self.catalog = catalog
+        self.folder = catalog.photo_store.folder
+        self.grace_period = grace_period
+        self.batch_size = batch_size
+        self.pause = pause
+        self._thread_pid = None
+        self._start_lock = threading.Lock()
+        self.passes = 0
+        self.scanned = 0
+        self.deleted = 0
+        self.bytes_freed = 0
+        self.kept_recent = 0
+        self.last_pass = None
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        self.deleted += 1
+        self.bytes_freed += size
+
+    def _collect(self, entry, now):
+        """Deletes one unreferenced file (and its photo record) if it is old enough."""
+        refs_store = self.catalog.photo_store.refs_store
+        key = entry.name.split('.', 1)[0].split('-', 1)[0]
+        if refs_store.get(key) is None:
+            self._remove(entry.path)
+            return
+        with refs_store.locked():
+            record = refs_store.get(key)
+            if record is None:
+                self._remove(entry.path)
+                return
+            # PhotoStore.save() touches a photo it reuses, which restarts the grace period
+            main = os.path.join(self.folder, record['file'])
+            try:
+                if now - os.path.getmtime(main) < self.grace_period:
+                    self.kept_recent += 1
+                    return
+            except FileNotFoundError:
+                pass
+            refs_store.delete(key)
+            self._remove(main)
+            for variant in record.get('variants', {}).values():
+                self._remove(os.path.join(self.folder, variant['file']))
+
+    def run(self, dry_run=False):
+        """Runs one pass; returns the unreferenced files found (and deleted unless dry_run)."""
+        with open(os.path.join(self.folder, '.gc.lock'), 'a') as lock_file, \
+                file_lock(lock_file, blocking=False) as locked:
+            if not locked:
+                return None
+            referenced = referenced_files(self.catalog.load())
+            now = time.time()
+            found = []
+            with os.scandir(self.folder) as entries:
+                for count, entry in enumerate(entries, 1):
+                    if count % self.batch_size == 0 and self.pause:
+                        time.sleep(self.pause)
+                    self.scanned += 1
+                    name = entry.name
+                    # Dot files are ours (.gc.lock), except abandoned upload spools
+                    if name.startswith('.') and not name.endswith('.part'):
+                        continue
+                    if name in referenced or not entry.is_file(follow_symlinks=False):
+                        continue
+                    try:
+                        age = now - entry.stat(follow_symlinks=False).st_mtime
+                    except FileNotFoundError:
+                        continue
+                    if age < self.grace_period:
+                        self.kept_recent += 1
+                        continue
+                    found.append(name)
+                    if not dry_run:
+                        self._collect(entry, now)
+            self.passes += 1
+            self.last_pass = now
+            return found
+
+    def _loop(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.run()
+            except Exception:
+                log.exception('Upload garbage collection failed')
+
+    def start(self, interval):
+        """Runs a pass every interval seconds in a daemon thread of this process."""
+        if self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread_pid != os.getpid():
+                threading.Thread(target=self._loop, args=(interval,), daemon=True).start()
+                self._thread_pid = os.getpid()
+
+    def stats(self):
+        return {
+            'passes': self.passes,
+            'scanned': self.scanned,
+            'deleted': self.deleted,
+            'bytes_freed': self.bytes_freed,
+            'kept_recent': self.kept_recent,
+            'last_pass': self.last_pass,
+        }
@@ -0,0 +1,61 @@
+import time
+import threading
+
+
+class UserDirectory:
+    """In-memory username lookups for the Flask-Login user_loader.
+
+    Lookups are served from a dict. The users store is asked whether the data
+    on disk has changed at most once every ``check_interval`` seconds, or right
+    away after invalidate(), which register() calls after adding a user.
+    A username missing from the dict is looked up again after asking the store,
+    so an account just registered by another worker is found straight away.
+    Before this cache, every lookup opened and parsed users.json.
+    ``disk_reads_saved`` counts the lookups that no longer do that.
+    """
+
+    def __init__(self, store, check_interval=1.0):
+        self.store = store
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._users = None
+        self._generation = None
+        self._checked_at = 0.0
+        self.lookups = 0
+        self.checks = 0
+        self.reloads = 0
+
+    def _current(self, refresh=False):
+        now = time.monotonic()
+        if self._users is not None and not refresh and now - self._checked_at < self.check_interval:
+            return self._users
+        with self._lock:
+            users = self.store.load()
+            generation = self.store.generation
+            if generation != self._generation:
+                self.reloads += 1
+                self._generation = generation
+            self.checks += 1
+            self._users = users
+            self._checked_at = now
+            return users
+
+    def get(self, username):
+        """Returns the stored record for username, or None."""
+        self.lookups += 1
+        checked_at = self._checked_at
+        record = self._current().get(username)
+        if record is None and self._checked_at == checked_at:
+            record = self._current(refresh=True).get(username)
+        return record
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    def stats(self):
+        return {
+            'lookups': self.lookups,
+            'checks': self.checks,
+            'reloads': self.reloads,
+            'disk_reads_saved': self.lookups - self.reloads,
+        }
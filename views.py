@@ -0,0 +1,426 @@
+import time
+import csv
+from flask import (current_app, abort, render_template, request, redirect, url_for, make_response, flash, jsonify,
+                   stream_with_context)
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.local import LocalProxy
+from flask_login import UserMixin, login_user, login_required, logout_user, current_user
+from flask_wtf.csrf import generate_csrf
+
+from listing import encode_cursor, decode_cursor
+from search import search_filters
+from http_cache import is_not_modified, set_validators
+from photos import image_type
+from images import VARIANT_SIZES
+from fragments import fill_csrf_token
+from metrics import span
+from bulk import MIMETYPES, format_from_name, read_rows, validate_rows, export_chunks
+
+MAX_REPORTED_ERRORS = 20
+
+# The objects create_app() set up for the current application
+catalog = LocalProxy(lambda: current_app.extensions['catalog'])
+user_directory = LocalProxy(lambda: current_app.extensions['user_directory'])
+passwords = LocalProxy(lambda: current_app.extensions['passwords'])
+contact_inbox = LocalProxy(lambda: current_app.extensions['contact_inbox'])
+
+
+class User(UserMixin):
+    def __init__(self, id):
+        self.id = id
+
+    @staticmethod
+    def get(user_id):
+        if user_directory.get(user_id) is not None:
+            return User(user_id)
+        return None
+
+
+def load_user(user_id):
+    return User.get(user_id)
+
+
+def photo_sources(car, limit=None):
+    """The src and srcset of each of a car's photos, preferring the resized variants."""
+    variants = car.get('photo_variants') or []
+    sources = []
+    for i, photo in enumerate(car.get('photos', [])[:limit]):
+        photo_variants = variants[i] if i < len(variants) else {}
+        card = photo_variants.get('card')
+        sources.append({
+            'src': url_for('static', filename='uploads/' + (card['file'] if card else photo.split('/')[-1])),
+            'srcset': ', '.join(f"{url_for('static', filename='uploads/' + variant['file'])} {variant['width']}w"
+                                for variant in photo_variants.values()),
+        })
+    return sources
+
+
+def format_timestamp(value):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(value))
+
+
+def form_result(success, message=None, redirect_to=None, **data):
+    """Answers a submitted form: JSON by default, or with RESPONSE_FORMAT = 'form'
+    a flashed message and a redirect to redirect_to."""
+    if current_app.config['RESPONSE_FORMAT'] == 'form':
+        if message:
+            flash(message, 'success' if success else 'danger')
+        return redirect(redirect_to)
+    if message:
+        data['message'] = message
+    return jsonify(success=success, **data)
+
+
+def index():
+    # Logged-in pages carry CSRF tokens for the delete forms, so only anonymous
+    # pages are revalidated instead of re-downloaded
+    cacheable = not current_user.is_authenticated
+    if cacheable:
+        etag, last_modified = catalog.validators('index', current_app.config['TEMPLATE_VERSION'],
+                                                 not_before=current_app.config['TEMPLATE_MODIFIED'])
+        if is_not_modified(etag, last_modified):
+            return set_validators(make_response('', 304), etag, last_modified)
+
+    cursor = decode_cursor(request.args.get('after'))
+    filters = search_filters(request.args)
+    with span('catalog.find'):
+        cars, next_cursor = catalog.page(catalog.find(filters), cursor, current_app.config['CARS_PER_PAGE'])
+    query_args = {key: value for key, value in request.args.items() if key != 'after' and value}
+    authenticated = current_user.is_authenticated
+    with span('render'):
+        html = render_template('index.html', cards=[catalog.cards.render(car, authenticated) for car in cars],
+                               next_cursor=encode_cursor(next_cursor),
+                               is_first_page=cursor is None,
+                               query_args=query_args)
+    if authenticated:
+        html = fill_csrf_token(html, generate_csrf() if current_app.config['CSRF_ENABLED'] else '')
+    response = make_response(html)
+    if cacheable:
+        set_validators(response, etag, last_modified)
+        response.vary.add('Cookie')
+    else:
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+    return response
+
+
+def api_cars():
+    etag, last_modified = catalog.validators('cars')
+    if is_not_modified(etag, last_modified):
+        return set_validators(make_response('', 304), etag, last_modified)
+
+    cursor = decode_cursor(request.args.get('after'))
+    with span('catalog.find'):
+        matches = catalog.find(search_filters(request.args))
+        cars, next_cursor = catalog.page(matches, cursor, current_app.config['CARS_PER_PAGE'])
+    with span('render'):
+        response = jsonify(total=len(matches), cars=cars, next_cursor=encode_cursor(next_cursor))
+    return set_validators(response, etag, last_modified)
+
+
+def api_car(car_id):
+    etag, last_modified = catalog.validators('car', car_id)
+    if is_not_modified(etag, last_modified):
+        return set_validators(make_response('', 304), etag, last_modified)
+
+    car = catalog.get(car_id)
+    if car is None:
+        return jsonify(success=False, message='Car not found.'), 404
+    return set_validators(jsonify(car), etag, last_modified)
+
+
+def car_detail(car_id):
+    cacheable = not current_user.is_authenticated
+    if cacheable:
+        etag, last_modified = catalog.validators('car_detail', car_id, current_app.config['TEMPLATE_VERSION'],
+                                                 not_before=current_app.config['TEMPLATE_MODIFIED'])
+        if is_not_modified(etag, last_modified):
+            return set_validators(make_response('', 304), etag, last_modified)
+
+    car = catalog.get(car_id)
+    if car is None:
+        abort(404)
+    with span('render'):
+        response = make_response(render_template('car.html', car=car))
+    if cacheable:
+        set_validators(response, etag, last_modified)
+        response.vary.add('Cookie')
+    else:
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+    return response
+
+
+def api_car_photos(car_id):
+    etag, last_modified = catalog.validators('photos', car_id)
+    if is_not_modified(etag, last_modified):
+        return set_validators(make_response('', 304), etag, last_modified)
+
+    car = catalog.get(car_id)
+    if car is None:
+        return jsonify(success=False, message='Car not found.'), 404
+    return set_validators(jsonify(photos=photo_sources(car)), etag, last_modified)
+
+
+@login_required
+def cache_stats():
+    extensions = current_app.extensions
+    stats = {
+        'stores': [catalog.store.stats(), user_directory.store.stats(), catalog.photo_store.refs_store.stats()],
+        'photos': catalog.photo_store.stats(),
+        'car_cards': catalog.cards.stats(),
+        'users': user_directory.stats(),
+        'passwords': passwords.stats(),
+        'startup': current_app.config['STARTUP_TIMES'],
+        'upload_gc': extensions['upload_gc'].stats(),
+    }
+    if 'contact_inbox' in extensions:
+        stats['inbox'] = contact_inbox.stats()
+    if 'admission' in extensions:
+        stats['admission'] = extensions['admission'].stats()
+    return jsonify(stats)
+
+
+def services():
+    if not current_app.config['CONTACT_FORM']:
+        return render_template('services.html', form=None)
+
+    from forms import ContactForm
+    form = ContactForm()
+    if form.validate_on_submit():
+        contact_data = {
+            'name': form.name.data,
+            'email': form.email.data,
+            'message': form.message.data,
+            'received_at': time.time()
+        }
+        if not contact_inbox.submit(contact_data):
+            return jsonify(success=False, message='We are receiving too many messages right now. Please try again shortly.'), 503
+        return jsonify(success=True, message='Message sent successfully!')
+    return render_template('services.html', form=form)
+
+
+@login_required
+def inbox():
+    page = max(request.args.get('page', 0, type=int), 0)
+    per_page = current_app.config['CONTACTS_PER_PAGE']
+    total = contact_inbox.count()
+    return render_template('inbox.html', messages=contact_inbox.page(page, per_page),
+                           page=page, total=total, has_next=(page + 1) * per_page < total)
+
+
+def register():
+    from forms import RegistrationForm
+    form = RegistrationForm()
+    if form.validate_on_submit():
+        users_store = user_directory.store
+        if users_store.get(form.username.data) is not None:
+            return form_result(False, 'Username already exists.', url_for('register'))
+
+        # Hash first, then check again and write under the lock, so two
+        # registrations of the same name cannot both succeed
+        with span('password.hash'):
+            hashed_password = passwords.hash(form.password.data)
+        with span('users.write'), users_store.locked():
+            if users_store.get(form.username.data) is not None:
+                return form_result(False, 'Username already exists.', url_for('register'))
+            users_store.put(form.username.data, {'password': hashed_password})
+        user_directory.invalidate()
+        return form_result(True, 'Registration successful! Please log in.', url_for('login'))
+
+    return render_template('register.html', form=form)
+
+
+def login():
+    from forms import LoginForm
+    form = LoginForm()
+    if form.validate_on_submit():
+        user_id = form.username.data
+        password = form.password.data
+        users_store = user_directory.store
+        with span('users.read'):
+            user_data = users_store.get(user_id)
+
+        with span('password.check'):
+            valid = user_data is not None and passwords.check(user_data['password'], password)
+        if valid:
+            with span('password.hash'):
+                new_hash = passwords.upgraded_hash(user_data['password'], password)
+            if new_hash is not None:
+                with span('users.write'), users_store.locked():
+                    # Only replace the hash we checked; the password may have changed meanwhile
+                    current = users_store.get(user_id)
+                    if current is not None and current['password'] == user_data['password']:
+                        users_store.put(user_id, dict(current, password=new_hash))
+            login_user(User(user_id))
+            return form_result(True, redirect_to=url_for('upload'), redirect_url=url_for('upload'))
+        return form_result(False, 'Invalid username or password.', url_for('login'))
+
+    return render_template('login.html', form=form)
+
+
+@login_required
+def logout():
+    logout_user()
+    return redirect(url_for('index'))
+
+
+@login_required
+def upload():
+    from forms import UploadForm
+    form = UploadForm()
+    if request.method == 'POST':
+        if not form.validate_on_submit():
+            errors = form.errors
+            return jsonify(success=False, message=str(errors))
+
+        photos = [file for file in request.files.getlist('photos') if file and file.filename != '']
+        # Check every file's content before storing or claiming any photo
+        extensions = [image_type(file) for file in photos]
+        for file, ext in zip(photos, extensions):
+            if ext is None:
+                return jsonify(success=False, message=f'{file.filename} is not a JPEG, PNG or GIF image.')
+
+        photo_filenames = []
+        photo_variants = []
+        # Photos sent beforehand to /upload/photo, in display order
+        for name in request.form.getlist('uploaded_photos'):
+            acquired = catalog.photo_store.acquire(name)
+            if acquired is None:
+                catalog.photo_store.release_many(zip(photo_filenames, photo_variants))
+                return jsonify(success=False, message='A photo upload has expired. Please add the photos again.')
+            photo_filenames.append(acquired[0])
+            photo_variants.append(acquired[1])
+        car = {
+            'id': catalog.new_id(),
+            'make': form.make.data,
+            'model': form.model.data,
+            'year': form.year.data,
+            'price': form.price.data,
+            'details': form.details.data,
+            'photos': photo_filenames,
+            'photo_variants': photo_variants,
+            'created_at': time.time()
+        }
+        try:
+            for file, ext in zip(photos, extensions):
+                with span('photo.save'):
+                    filename, variants = catalog.photo_store.save(file, ext)
+                photo_filenames.append(filename)
+                photo_variants.append(variants)
+            with span('catalog.add'):
+                catalog.add(car)
+        except Exception:
+            # Give back the references taken so far, or those photos would never
+            # be deleted; unless the car was stored after all and now uses them
+            if catalog.get(car['id']) is None:
+                catalog.photo_store.release_many(zip(photo_filenames, photo_variants))
+            raise
+
+        return jsonify(success=True, message='Car uploaded successfully!')
+
+    return render_template('upload.html', form=form, max_photo_edge=VARIANT_SIZES['full'])
+
+
+@login_required
+def upload_photo():
+    """Stores one photo ahead of the car form, which then lists it in uploaded_photos."""
+    file = request.files.get('photo')
+    if file is None or file.filename == '':
+        return jsonify(success=False, message='No photo received.'), 400
+    ext = image_type(file)
+    if ext is None:
+        return jsonify(success=False, message=f'{file.filename} is not a JPEG, PNG or GIF image.'), 400
+    with span('photo.save'):
+        filename, variants = catalog.photo_store.save(file, ext, reference=False)
+    return jsonify(success=True, photo=filename)
+
+
+def upload_too_large(error):
+    return jsonify(success=False, message='Upload is too large.'), 413
+
+
+@login_required
+def delete_car(car_id):
+    with span('catalog.remove'):
+        catalog.remove(car_id)
+    return redirect(url_for('index'))
+
+
+@login_required
+def import_cars():
+    """Adds the cars in a CSV or JSONL request body, all in one write or none at all."""
+    fmt = format_from_name(request.args.get('format')) or {
+        mimetype: fmt for fmt, mimetype in MIMETYPES.items()}.get(request.mimetype)
+    if fmt is None:
+        return jsonify(success=False, message='Send a text/csv or application/x-ndjson body, '
+                                              'or add ?format=csv or ?format=jsonl.'), 415
+    from forms import UploadForm
+    try:
+        with span('import.validate'):
+            cars, errors = validate_rows(read_rows(request.stream, fmt), UploadForm, catalog.new_id)
+    except (ValueError, csv.Error) as error:
+        return jsonify(success=False, message=f'Could not read the file: {error}'), 400
+    if errors:
+        return jsonify(success=False, message=f'{len(errors)} rows are invalid; nothing was imported.',
+                       errors=errors[:MAX_REPORTED_ERRORS]), 400
+    with span('catalog.add'):
+        catalog.add_many(cars)
+    return jsonify(success=True, message=f'{len(cars)} cars imported.', imported=len(cars))
+
+
+@login_required
+def export_cars():
+    fmt = format_from_name(request.args.get('format', 'csv'))
+    if fmt is None:
+        return jsonify(success=False, message='Unknown format; use csv or jsonl.'), 400
+    response = current_app.response_class(stream_with_context(export_chunks(catalog.iterate(), fmt)),
+                                          mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=cars.{fmt}'
+    return response
+
+
+@login_required
+def delete_cars():
+    """Deletes the cars listed in 'ids' (JSON body or form fields) in one write."""
+    if request.is_json:
+        ids = (request.get_json(silent=True) or {}).get('ids')
+    else:
+        ids = request.form.getlist('ids')
+    if not ids or not isinstance(ids, list):
+        return jsonify(success=False, message='No car ids given.'), 400
+    with span('catalog.remove'):
+        removed = catalog.remove_many(ids)
+    return jsonify(success=True, message=f'{len(removed)} cars deleted.', deleted=[car['id'] for car in removed])
+
+
+ROUTES = [
+    ('/', index, ['GET']),
+    ('/api/cars', api_cars, ['GET']),
+    ('/search', api_cars, ['GET']),
+    ('/api/cars/import', import_cars, ['POST']),
+    ('/api/cars/export', export_cars, ['GET']),
+    ('/api/cars/delete', delete_cars, ['POST']),
+    ('/api/cars/<string:car_id>', api_car, ['GET']),
+    ('/api/cars/<string:car_id>/photos', api_car_photos, ['GET']),
+    ('/car/<string:car_id>', car_detail, ['GET']),
+    ('/cache_stats', cache_stats, ['GET']),
+    ('/services', services, ['GET', 'POST']),
+    ('/register', register, ['GET', 'POST']),
+    ('/login', login, ['GET', 'POST']),
+    ('/logout', logout, ['GET']),
+    ('/upload', upload, ['GET', 'POST']),
+    ('/upload/photo', upload_photo, ['POST']),
+    ('/delete_car/<string:car_id>', delete_car, ['POST']),
+]
+
+
+def init_app(app):
+    """Registers the routes, error handlers and template helpers on app."""
+    for rule, view, methods in ROUTES:
+        app.add_url_rule(rule, view_func=view, methods=methods)
+    if app.config['CONTACT_FORM']:
+        app.add_url_rule('/inbox', view_func=inbox)
+    app.register_error_handler(RequestEntityTooLarge, upload_too_large)
+    app.add_template_global(photo_sources)
+    app.add_template_filter(format_timestamp, 'timestamp')